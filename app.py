@@ -1,13 +1,29 @@
-import sys, os
-from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QHBoxLayout, QVBoxLayout, QMainWindow, QFileDialog, QSpacerItem, QSizePolicy, QLabel, QMessageBox
+import sys, os, time
+STARTUP_TIME = time.perf_counter()  # taken before any other import so the startup report covers them
+from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QHBoxLayout, QVBoxLayout, QMainWindow, QFileDialog, QSpacerItem, QSizePolicy, QLabel, QListWidget, QListWidgetItem
 from PyQt5.QtCore import Qt, QUrl, QTimer, pyqtSignal, QObject, QThread
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
 from PyQt5.QtMultimediaWidgets import QVideoWidget
 from PyQt5.QtGui import QFont
-import find_frame
-import audiofingerprint
-import find_similar_video
+import argparse
 import datetime
+import importlib
+import json
+import threading
+import collections
+import instrumentation
+import result_cache
+
+# the matching modules pull in OpenCV, SciPy and librosa, so they are imported on first use
+# (or ahead of time by the prewarm thread) and the window can show before any of them is loaded
+PREWARM_MODULES = ('audiofingerprint', 'find_similar_video', 'find_frame', 'pipeline')
+NO_PREWARM_ENV = 'VIDEO_MATCHER_NO_PREWARM'
+
+# queries matched at once, the rest wait their turn - each match decodes two videos so a few saturate the CPU
+MAX_CONCURRENT_MATCHES = max(1, min(4, (os.cpu_count() or 2) // 2))
+
+# how long closing the window waits for cancelled matches to reach their next stage boundary
+CLOSE_TIMEOUT_SECONDS = 10
 
 # utility conversion function
 def format_time_hh_mm_ss_ms(ms):
@@ -19,6 +35,10 @@ def format_time_hh_mm_ss_ms(ms):
     hours, minutes = divmod(minutes, 60)
     return f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
 
+def is_low_confidence(confidence):
+    import audiofingerprint  # already loaded by the match that produced the confidence
+    return confidence < audiofingerprint.LOW_CONFIDENCE_PSR
+
 # remove the _modifiedmp4
 def sanitize_name(full_path):
     base_name = os.path.basename(full_path) # extract file name from full path
@@ -32,6 +52,8 @@ class Controls(QWidget):
     pause_signal = pyqtSignal()
     reset_signal = pyqtSignal()
     upload_video_signal = pyqtSignal()
+    replace_video_signal = pyqtSignal()
+    cancel_signal = pyqtSignal()
 
     def __init__(self):
         super().__init__()
@@ -45,7 +67,16 @@ class Controls(QWidget):
         self.upload_button = QPushButton('Upload', self)
         self.upload_button.setFixedSize(90, 35) 
         upload_layout = QHBoxLayout()
+        self.cancel_button = QPushButton('Cancel All', self)
+        self.cancel_button.setFixedSize(90, 35)
+        # cancels every queued and running match, then matches the new upload straight away
+        self.replace_button = QPushButton('Replace', self)
+        self.replace_button.setFixedSize(90, 35)
         upload_layout.addStretch()  # add stretch to push the button to the right
+        upload_layout.addWidget(self.cancel_button)
+        upload_layout.addSpacing(10)
+        upload_layout.addWidget(self.replace_button)
+        upload_layout.addSpacing(10)
         upload_layout.addWidget(self.upload_button)
         upload_layout.setContentsMargins(0, 0, 0, 0)  # 0 margin default
         upload_layout.setSpacing(0)
@@ -87,6 +118,8 @@ class Controls(QWidget):
         self.pause_button.clicked.connect(self.pause_signal.emit)
         self.reset_button.clicked.connect(self.reset_signal.emit)
         self.upload_button.clicked.connect(self.upload_video_signal.emit)
+        self.replace_button.clicked.connect(self.replace_video_signal.emit)
+        self.cancel_button.clicked.connect(self.cancel_signal.emit)
     
     
     
@@ -151,47 +184,166 @@ class VideoPlayer(QVideoWidget):
         
         
         
+class MatchCancelled(Exception):
+    pass
+
+_match_context = None
+_match_context_lock = threading.Lock()
+
+def shared_match_context():
+    # every concurrent match reads the same memory-mapped indexes, loaded by whichever worker gets there first
+    global _match_context
+    import pipeline
+    with _match_context_lock:
+        if _match_context is None:
+            _match_context = pipeline.MatchContext.load(result_cache_dir=result_cache.DEFAULT_RESULT_CACHE_DIR)
+        return _match_context
+
+class MatchJob:
+    """
+    One uploaded query, its place in the pool and its result once matched.
+    """
+    def __init__(self, query_video_path):
+        self.query_video_path = query_video_path
+        self.query_video_name = sanitize_name(query_video_path)
+        self.status = "Queued"
+        self.original_video_path = None
+        self.frame_match_index = None
+        self.offset_seconds = None
+        self.offset_confidence = float('inf')
+        self.cancelled = False
+        self.worker = None
+        self.item = None  # row in the results list
+
+    def is_matched(self):
+        return self.frame_match_index is not None
+
+    def describe(self):
+        if self.is_matched():
+            offset_str = format_time_hh_mm_ss_ms(self.offset_seconds * 1000)
+            return (f"{self.query_video_name} -> {os.path.basename(self.original_video_path)} | Start Time: {offset_str} | "
+                    f"Frame Index: {self.frame_match_index} | Confidence: {self.offset_confidence:.1f}")
+        return f"{self.query_video_name} - {self.status}"
+
 # worker is a unit of work to be put on "background" thread - processing allows execution without "Not responding..." hangup
 class Worker(QObject):
     finished = pyqtSignal(int, float)  
     error = pyqtSignal(str)
+    offset_confidence = pyqtSignal(float)  # peak-to-sidelobe ratio of the audio offset, emitted before finished
+    stage_report = pyqtSignal(object)  # {stage: {wall_seconds, thread_cpu_seconds, rss_delta_bytes, ...}}, emitted before finished
+    identified = pyqtSignal(str)  # path of the matched reference video
+    progress = pyqtSignal(str, int)  # stage description, percent done
+    cancelled = pyqtSignal()
+    done = pyqtSignal()  # always emitted last, whatever the outcome - drives thread cleanup
 
-    def __init__(self, query_video_path, original_video_path):
+    def __init__(self, query_video_path):
         super().__init__()
         self.query_video_path = query_video_path
-        self.original_video_path = original_video_path
+        self.cancel_requested = threading.Event()
+
+    def cancel(self):
+        # called straight from the GUI thread, the worker's own event loop is busy in run()
+        self.cancel_requested.set()
+
+    def check_cancelled(self):
+        if self.cancel_requested.is_set():
+            raise MatchCancelled()
 
     def run(self):
+        import pipeline
+        recorder = instrumentation.StageRecorder(
+            profile_path=instrumentation.profile_path(os.environ.get(instrumentation.PROFILE_DIR_ENV), self.query_video_path))
         try:
-            # clean up temporary files <- from original find_frame.py
-            audiofingerprint.remove_temporary_files('original_audio.wav', 'query_audio.wav')
-            
-            # audio extraction <- from original find_frame.py
-            audiofingerprint.extract_audio(self.query_video_path, 'query_audio.wav')
-            audiofingerprint.extract_audio(self.original_video_path, 'original_audio.wav')
+            # identification runs here too so the window never blocks on the hash scan
+            self.progress.emit("Identifying video...", 0)
+            context = shared_match_context()
+
+            # resubmitted clips are answered straight from the result cache
+            digest, cached = pipeline.cached_match(self.query_video_path, context, recorder)
+            if cached is not None:
+                recorder.finish()
+                self.identified.emit(context.video_path(cached['video']))
+                self.offset_confidence.emit(cached['confidence'])
+                self.progress.emit("Match found (cached)", 100)
+                self.finished.emit(cached['frame_index'], cached['offset_seconds'])
+                return
 
-            # audio fingerprint comparison to find offset <- from original find_frame.py
-            offset_seconds = audiofingerprint.find_offset('original_audio.wav', 'query_audio.wav', 10)
+            with recorder.stage('identify'):
+                original_video_name, landmark_offset, query_audio = pipeline.identify_query(self.query_video_path, context)
+            original_video_path = context.video_path(original_video_name)
+            self.identified.emit(original_video_path)
+            self.check_cancelled()
+
+            # audio fingerprint comparison to find offset, the reference audio comes from the index-time cache when built
+            self.progress.emit("Locating audio offset...", 30)
+            offset_seconds, confidence = pipeline.locate_query(self.query_video_path, original_video_name, context, recorder,
+                                                              query_audio, landmark_offset)
+            self.offset_confidence.emit(confidence)
+            self.check_cancelled()
 
             # frame matching based on audio offset
-            frame_match_index = find_frame.process_videos(self.original_video_path, self.query_video_path, offset_seconds)
+            self.progress.emit("Aligning frames...", 50)
+            frame_match_index = pipeline.align_query(self.query_video_path, original_video_name, offset_seconds, context, recorder)
+            self.check_cancelled()
+            pipeline.store_match(digest, context, original_video_name, offset_seconds, frame_match_index, confidence)
+
+            # structured per-stage report, also printed so slow matches can be pinned to a stage from the console
+            stages = recorder.finish()
+            print(json.dumps({'query': self.query_video_path, 'stages': stages}))
+            self.stage_report.emit(stages)
+            self.progress.emit("Match found", 100)
             
             # this emission should get handled by our worker thread to set class attributes
             self.finished.emit(frame_match_index, offset_seconds)
-
-            # clean up temporary files
-            audiofingerprint.remove_temporary_files('original_audio.wav', 'query_audio.wav')
+        except MatchCancelled:
+            recorder.finish()
+            self.cancelled.emit()
         except Exception as e:
+            recorder.finish()
             self.error.emit(str(e))
+        finally:
+            self.done.emit()
                    
+class Prewarmer(QObject):
+    """
+    Imports the matching modules and maps the reference indexes in the background,
+    so the first match does not pay for them while the user is still picking a file.
+    """
+    finished = pyqtSignal(object)  # {'imports': {module: seconds}, 'index_seconds': ..., 'error': ...}
+
+    def run(self):
+        report = {'imports': {}}
+        try:
+            # each timing only covers what the earlier modules did not already import
+            for module_name in PREWARM_MODULES:
+                start = time.perf_counter()
+                importlib.import_module(module_name)
+                report['imports'][module_name] = time.perf_counter() - start
+            start = time.perf_counter()
+            shared_match_context()
+            report['index_seconds'] = time.perf_counter() - start
+        except Exception as e:
+            # not fatal, the first match loads whatever is missing and reports the error itself
+            report['error'] = f"{type(e).__name__}: {e}"
+        self.finished.emit(report)
+        # stop our own thread, a quit queued through the GUI thread would never arrive while closeEvent waits on it
+        self.thread().quit()
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.initialize_interface()
         self.frame_match_index = 0
         self.offset_seconds = 0
+        self.offset_confidence = float('inf')
         self.videos_ready = False  # Tracks if both videos are loaded
         self.query_video_name = ""
+        self.pending_jobs = collections.deque()  # uploaded but waiting for a free slot in the pool
+        self.running_jobs = {}  # worker -> job, at most MAX_CONCURRENT_MATCHES
+        self.displayed_job = None  # job whose videos are on screen
+        self.play_when_ready = False
+        self.retired_threads = []  # finished or cancelled matches still winding down, kept alive until their thread stops
+        self.startup_report = {}
         
     def initialize_interface(self):
         # interface work - nothing notable here creating UI, screens, screen size, adding controls, connecting controls to handlers
@@ -219,6 +371,12 @@ class MainWindow(QMainWindow):
 
         main_layout.addLayout(video_layout)
 
+        # one row per uploaded query, filled in as matches complete - select a row to play it
+        self.results_list = QListWidget()
+        self.results_list.setMaximumHeight(120)
+        self.results_list.itemClicked.connect(self.on_result_selected)
+        main_layout.addWidget(self.results_list)
+
         self.controls = Controls()
         main_layout.addStretch(1) 
         
@@ -231,6 +389,8 @@ class MainWindow(QMainWindow):
         self.controls.pause_signal.connect(self.match_screen.pause)
         self.controls.reset_signal.connect(self.match_screen.reset)
         self.controls.upload_video_signal.connect(self.upload_video)
+        self.controls.replace_video_signal.connect(self.replace_video)
+        self.controls.cancel_signal.connect(self.cancel_all_matches)
                 
     def handle_media_status_change(self, status):
         # check if both videos are loaded
@@ -239,52 +399,194 @@ class MainWindow(QMainWindow):
             self.videos_ready = True
         else:
             self.videos_ready = False
+        if self.videos_ready and self.play_when_ready:
+            self.play_when_ready = False
+            self.on_displayed_job_ready()
 
     def upload_video(self):
-        file_name, _ = QFileDialog.getOpenFileName(self, "Open Video", "", "Video Files (*.mp4)")
-        if file_name:
-            # disable controls immediately after a file is selected
-            self.controls.play_button.setEnabled(False)
-            self.controls.pause_button.setEnabled(False)
-            self.controls.reset_button.setEnabled(False)
-
-            original_video_filename = find_similar_video.find_similar_video(file_name, './preprocessing.json')
-            self.query_video_name = sanitize_name(file_name) # setup query video name - OUTPUT VARIABLE
-            original_video_path = os.path.join(os.path.abspath("video/"), original_video_filename)
-
-            self.query_screen.load_video(file_name)
-            self.match_screen.load_video(original_video_path)
-
-            # set "Looking for a match..." message
-            self.query_screen.set_message("Looking for a match...")
-            self.match_screen.set_message("Looking for a match...")
-            self.videos_ready = False
-            
-            # setup the thread and worker
-            self.thread = QThread()
-            self.worker = Worker(file_name, original_video_path)
-            self.worker.moveToThread(self.thread)
-            self.thread.started.connect(self.worker.run)
-            self.worker.finished.connect(self.on_processing_finished)
-            self.worker.error.connect(self.handle_error)
+        file_names, _ = QFileDialog.getOpenFileNames(self, "Open Videos", "", "Video Files (*.mp4)")
+        # every selected file is queued, uploads made while others are still matching join the same queue
+        self.queue_videos(file_names)
+
+    def replace_video(self):
+        file_names, _ = QFileDialog.getOpenFileNames(self, "Open Videos", "", "Video Files (*.mp4)")
+        # closing the dialog leaves the current matches alone
+        if file_names:
+            self.cancel_all_matches()
+            self.queue_videos(file_names)
+
+    def queue_videos(self, file_names):
+        for file_name in file_names:
+            job = MatchJob(file_name)
+            job.item = QListWidgetItem(job.describe())
+            job.item.setData(Qt.UserRole, job)
+            self.results_list.addItem(job.item)
+            self.pending_jobs.append(job)
+        self.dispatch_jobs()
+
+    def dispatch_jobs(self):
+        # cancelled matches only wind down to their next stage boundary, so they do not hold a slot
+        while self.pending_jobs and sum(not job.cancelled for job in self.running_jobs.values()) < MAX_CONCURRENT_MATCHES:
+            self.start_job(self.pending_jobs.popleft())
+        self.update_queue_status()
+
+    def start_job(self, job):
+        # each job gets its own thread and worker, nothing but the read-only indexes is shared between them
+        thread = QThread()
+        job.worker = Worker(job.query_video_path)
+        job.worker.moveToThread(thread)
+        thread.started.connect(job.worker.run)
+        job.worker.identified.connect(self.on_video_identified)
+        job.worker.progress.connect(self.on_progress)
+        job.worker.finished.connect(self.on_processing_finished)
+        job.worker.offset_confidence.connect(self.on_offset_confidence)
+        job.worker.error.connect(self.handle_error)
+        job.worker.cancelled.connect(self.on_match_cancelled)
+        job.worker.done.connect(self.on_worker_done)
+
+        # cleanup and thread management - the worker is released from on_worker_done so it outlives
+        # every signal it queued to this thread, which sender_job relies on
+        thread.finished.connect(thread.deleteLater)
+        # dropping the last reference to a running QThread destroys it, so hold on until it has stopped
+        self.retired_threads.append(thread)
+        thread.finished.connect(lambda: self.retired_threads.remove(thread))
+
+        self.running_jobs[job.worker] = job
+        job.status = "Starting..."
+        self.refresh_job(job)
+        thread.start()
+
+    def cancel_all_matches(self):
+        while self.pending_jobs:
+            job = self.pending_jobs.popleft()
+            job.status = "Cancelled"
+            self.refresh_job(job)
+        # running matches stop at their next stage boundary and report back through on_match_cancelled
+        for job in self.running_jobs.values():
+            job.cancelled = True
+            job.worker.cancel()
+        self.update_queue_status()
+
+    def start_prewarm(self):
+        thread = QThread()
+        self.prewarmer = Prewarmer()
+        self.prewarmer.moveToThread(thread)
+        thread.started.connect(self.prewarmer.run)
+        self.prewarmer.finished.connect(self.on_prewarm_finished)
+        thread.finished.connect(thread.deleteLater)
+        # waited for on close like the match threads
+        self.retired_threads.append(thread)
+        thread.finished.connect(lambda: self.retired_threads.remove(thread))
+        thread.start()
+
+    def on_prewarm_finished(self, report):
+        self.startup_report.update(report)
+        self.startup_report['ready_seconds'] = time.perf_counter() - STARTUP_TIME
+        print(json.dumps({'startup': self.startup_report}))
+        if 'error' in report:
+            print(f"WARNING: prewarm failed, matching will load on first use ({report['error']}).")
+        elif not self.running_jobs and not self.pending_jobs and self.displayed_job is None:
+            self.statusBar().showMessage("Ready", 3000)
+
+    def closeEvent(self, event):
+        self.cancel_all_matches()
+        # on_worker_done never runs while this blocks the GUI thread, so stop the event loops here,
+        # each thread then ends as soon as its worker returns
+        threads = list(self.retired_threads)
+        for thread in threads:
+            thread.quit()
+        deadline = time.monotonic() + CLOSE_TIMEOUT_SECONDS
+        for thread in threads:
+            if not thread.wait(max(0, int((deadline - time.monotonic()) * 1000))):
+                print("WARNING: a background thread did not stop in time, closing anyway.")
+                break
+        super().closeEvent(event)
 
-            # cleanup and thread management
-            self.worker.finished.connect(self.thread.quit)
-            self.worker.finished.connect(self.worker.deleteLater)
-            self.thread.finished.connect(self.thread.deleteLater)
+    def sender_job(self):
+        return self.running_jobs.get(self.sender())
 
-            self.thread.start()
+    def refresh_job(self, job):
+        job.item.setText(job.describe())
+
+    def update_queue_status(self):
+        if self.running_jobs or self.pending_jobs:
+            self.statusBar().showMessage(f"{len(self.running_jobs)} matching, {len(self.pending_jobs)} queued")
+        elif self.displayed_job is None or not is_low_confidence(self.displayed_job.offset_confidence):
+            self.statusBar().clearMessage()
+
+    def on_worker_done(self):
+        worker = self.sender()
+        self.running_jobs.pop(worker, None)
+        worker.thread().quit()
+        worker.deleteLater()
+        self.dispatch_jobs()
+
+    def on_video_identified(self, original_video_path):
+        job = self.sender_job()
+        if job is not None:
+            job.original_video_path = original_video_path
+
+    def on_progress(self, message, percent):
+        job = self.sender_job()
+        if job is None or job.cancelled:
+            return
+        job.status = f"{message} ({percent}%)"
+        self.refresh_job(job)
 
     def on_processing_finished(self, frame_match_index, offset_seconds):
         # emits captured on complete of processing, keep an eye out for emits shot by Worker class
-        self.frame_match_index = frame_match_index # setup frame match index - also works as an OUTPUT VARIABLE
-        self.offset_seconds = offset_seconds # capture offset seconds, works as an OUTPUT VARIABLE 
-        if self.videos_ready:
-            # Enable buttons only after both videos are loaded and processing is complete
-            self.update_info_display()
-            self.controls.play_button.setEnabled(True)
-            self.controls.pause_button.setEnabled(True)
-            self.controls.reset_button.setEnabled(True)
+        job = self.sender_job()
+        if job is None:
+            return
+        job.frame_match_index = frame_match_index
+        job.offset_seconds = offset_seconds
+        job.status = "Done"
+        self.refresh_job(job)
+        # the first result plays straight away, later ones wait in the list until selected
+        if self.displayed_job is None:
+            self.show_job(job)
+
+    def on_offset_confidence(self, confidence):
+        job = self.sender_job()
+        if job is not None:
+            job.offset_confidence = confidence
+
+    def on_match_cancelled(self):
+        job = self.sender_job()
+        if job is not None:
+            job.status = "Cancelled"
+            self.refresh_job(job)
+
+    def on_result_selected(self, item):
+        job = item.data(Qt.UserRole)
+        if job.is_matched():
+            self.show_job(job)
+
+    def show_job(self, job):
+        self.displayed_job = job
+        self.query_video_name = job.query_video_name # setup query video name - OUTPUT VARIABLE
+        self.frame_match_index = job.frame_match_index # setup frame match index - also works as an OUTPUT VARIABLE
+        self.offset_seconds = job.offset_seconds # capture offset seconds, works as an OUTPUT VARIABLE
+        self.offset_confidence = job.offset_confidence
+
+        # disable controls until both videos are loaded
+        self.controls.play_button.setEnabled(False)
+        self.controls.pause_button.setEnabled(False)
+        self.controls.reset_button.setEnabled(False)
+        self.results_list.setCurrentItem(job.item)
+        self.statusBar().clearMessage()
+
+        self.play_when_ready = True
+        self.videos_ready = False
+        self.query_screen.load_video(job.query_video_path)
+        self.match_screen.load_video(job.original_video_path)
+
+    def on_displayed_job_ready(self):
+        # Enable buttons only after both videos are loaded and processing is complete
+        self.update_info_display()
+        self.controls.play_button.setEnabled(True)
+        self.controls.pause_button.setEnabled(True)
+        self.controls.reset_button.setEnabled(True)
         QTimer.singleShot(1000, self.start_videos)
 
     def update_info_display(self):
@@ -295,11 +597,21 @@ class MainWindow(QMainWindow):
         duration_str = format_time_hh_mm_ss_ms(duration_ms)
         
         info_text = (f"RESULTS\n-------------------------------------------! \nFile: {self.query_video_name} | Start Time: {offset_time_str} | "
-                     f"Duration: {duration_str} | Frame Index: {self.frame_match_index}\n-------------------------------------------")
+                     f"Duration: {duration_str} | Frame Index: {self.frame_match_index} | Confidence: {self.offset_confidence:.1f}\n-------------------------------------------")
         print(info_text)
+        if is_low_confidence(self.offset_confidence):
+            # flag unreliable audio offsets instead of silently playing a possibly wrong position
+            self.statusBar().showMessage(f"Low confidence match for {self.query_video_name}, the start position may be wrong.")
+            print(f"WARNING: low audio offset confidence ({self.offset_confidence:.1f}).")
         
     def handle_error(self, message):
-        QMessageBox.critical(self, "Error", message)
+        # errors stay on the job's row instead of a modal box per failed query
+        job = self.sender_job()
+        if job is None:
+            return
+        job.status = f"Error: {message}"
+        self.refresh_job(job)
+        print(f"ERROR: {job.query_video_name}: {message}")
 
     def start_videos(self):
         # Assuming we now have frame_match_index properly set
@@ -307,10 +619,26 @@ class MainWindow(QMainWindow):
         self.match_screen.play_from_frame(self.frame_match_index)      
      
 def main():
-    app = QApplication(sys.argv)
+    parser = argparse.ArgumentParser(description="Video Matcher")
+    parser.add_argument('--no-prewarm', action='store_true',
+                        help=f"load the matching modules and index on first use instead of in the background (or set {NO_PREWARM_ENV}=1)")
+    args, qt_args = parser.parse_known_args()
+
+    app = QApplication(sys.argv[:1] + qt_args)
     main_window = MainWindow()
     main_window.show()
-    sys.exit(app.exec_())
+    main_window.startup_report['window_shown_seconds'] = time.perf_counter() - STARTUP_TIME
+    if args.no_prewarm or os.environ.get(NO_PREWARM_ENV):
+        print(json.dumps({'startup': main_window.startup_report}))
+    else:
+        main_window.start_prewarm()
+    exit_code = app.exec_()
+    if any(thread.isRunning() for thread in main_window.retired_threads):
+        # a match stuck past the close timeout, interpreter shutdown would tear its thread down mid-call
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+    sys.exit(exit_code)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,112 @@
+import os
+import numpy as np
+import audiofingerprint
+import landmark
+
+DEFAULT_AUDIO_CACHE_DIR = './audio_cache'
+DEFAULT_LANDMARK_INDEX_DIR = './landmark_index'
+
+# per-video landmarks, merged into the library-wide inverted index by build_landmark_index
+LANDMARK_DTYPE = np.dtype([('hash', '<u4'), ('frame', '<i4')])
+
+def cache_path(video_name, cache_dir=DEFAULT_AUDIO_CACHE_DIR, sample_rate=audiofingerprint.ANALYSIS_SAMPLE_RATE):
+    """
+    Cache file for a reference video, named after its index entry and the analysis rate.
+    """
+    safe_name = video_name.replace('/', '__')
+    return os.path.join(cache_dir, f"{safe_name}.{sample_rate}.npy")
+
+def landmarks_path(video_name, cache_dir=DEFAULT_AUDIO_CACHE_DIR, sample_rate=audiofingerprint.ANALYSIS_SAMPLE_RATE):
+    return cache_path(video_name, cache_dir, sample_rate)[:-len('.npy')] + '.landmarks.npy'
+
+def no_audio_path(video_name, cache_dir=DEFAULT_AUDIO_CACHE_DIR, sample_rate=audiofingerprint.ANALYSIS_SAMPLE_RATE):
+    """
+    Marker recording that a reference video has no decodable audio, so incremental builds do not retry it.
+    """
+    return cache_path(video_name, cache_dir, sample_rate)[:-len('.npy')] + '.noaudio'
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _save_atomically(path, array):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as cache_file:
+        np.save(cache_file, array)
+    os.replace(tmp_path, path)
+
+def build_reference_audio(video_name, video_path, cache_dir=DEFAULT_AUDIO_CACHE_DIR, sample_rate=audiofingerprint.ANALYSIS_SAMPLE_RATE):
+    """
+    Decode a reference video's audio once and store it as int16 PCM at the analysis rate,
+    together with its landmark fingerprints.
+    """
+    samples = audiofingerprint.load_audio(video_path, sample_rate)
+    peak = float(np.abs(samples).max()) if len(samples) else 0.0
+    # the correlation is scale invariant, so normalise to use the full int16 range
+    pcm = (samples * (32767 / peak)).astype(np.int16) if peak > 0 else samples.astype(np.int16)
+
+    hashes, frames = landmark.fingerprint(samples, sample_rate)
+    landmarks = np.empty(len(hashes), dtype=LANDMARK_DTYPE)
+    landmarks['hash'] = hashes
+    landmarks['frame'] = frames
+
+    os.makedirs(cache_dir, exist_ok=True)
+    _save_atomically(landmarks_path(video_name, cache_dir, sample_rate), landmarks)
+    # the PCM goes last, its presence marks the entry as complete
+    path = cache_path(video_name, cache_dir, sample_rate)
+    _save_atomically(path, pcm)
+    _remove(no_audio_path(video_name, cache_dir, sample_rate))
+    return path
+
+def mark_no_audio(video_name, reason, cache_dir=DEFAULT_AUDIO_CACHE_DIR, sample_rate=audiofingerprint.ANALYSIS_SAMPLE_RATE):
+    """
+    Record that a reference video has no audio, dropping whatever an earlier version of the file cached.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    _remove(cache_path(video_name, cache_dir, sample_rate))
+    _remove(landmarks_path(video_name, cache_dir, sample_rate))
+    with open(no_audio_path(video_name, cache_dir, sample_rate), 'w') as marker_file:
+        marker_file.write(reason)
+
+def has_reference_audio(video_name, cache_dir=DEFAULT_AUDIO_CACHE_DIR, sample_rate=audiofingerprint.ANALYSIS_SAMPLE_RATE):
+    """
+    True once the video's audio is cached, or recorded as missing.
+    """
+    if os.path.exists(no_audio_path(video_name, cache_dir, sample_rate)):
+        return True
+    return (os.path.exists(cache_path(video_name, cache_dir, sample_rate))
+            and os.path.exists(landmarks_path(video_name, cache_dir, sample_rate)))
+
+def load_reference_audio(video_name, cache_dir=DEFAULT_AUDIO_CACHE_DIR, sample_rate=audiofingerprint.ANALYSIS_SAMPLE_RATE):
+    """
+    Memory-map the cached PCM of a reference video, or return None if it was never built.
+    """
+    path = cache_path(video_name, cache_dir, sample_rate)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r')
+
+def build_landmark_index(video_names, index_dir=DEFAULT_LANDMARK_INDEX_DIR, cache_dir=DEFAULT_AUDIO_CACHE_DIR,
+                         sample_rate=audiofingerprint.ANALYSIS_SAMPLE_RATE):
+    """
+    Merge the cached landmarks of the given reference videos into one inverted index on disk.
+    Videos without cached landmarks are left out.
+    """
+    fingerprints = {}
+    for name in video_names:
+        path = landmarks_path(name, cache_dir, sample_rate)
+        if os.path.exists(path):
+            landmarks = np.load(path)
+            fingerprints[name] = (landmarks['hash'], landmarks['frame'])
+    landmark.LandmarkIndex.build(fingerprints, sample_rate).save(index_dir)
+    return index_dir
+
+def load_landmark_index(index_dir=DEFAULT_LANDMARK_INDEX_DIR):
+    """
+    Memory-map the library-wide landmark index, or return None if it was never built.
+    """
+    if not os.path.exists(os.path.join(index_dir, 'names.json')):
+        return None
+    return landmark.LandmarkIndex.load(index_dir)
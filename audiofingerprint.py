@@ -4,6 +4,16 @@ import numpy as np
 from scipy import signal
 import os
 import find_similar_video
+import landmark
+
+# analysis rate for piped audio, offsets are only needed to about 1/30 s
+ANALYSIS_SAMPLE_RATE = 8000
+
+# multi-resolution correlator: coarse search on ENVELOPE_RATE Hz envelopes, then refine the best
+# COARSE_CANDIDATES peaks at full rate; peak-to-sidelobe ratios below LOW_CONFIDENCE_PSR are unreliable
+ENVELOPE_RATE = 100
+COARSE_CANDIDATES = 3
+LOW_CONFIDENCE_PSR = 6.0
 
 def remove_temporary_files(original_audio,query_audio ):
     if os.path.exists(original_audio):
@@ -35,19 +45,168 @@ def extract_audio(video_path, output_audio_path):
     except subprocess.CalledProcessError as e:
         print(f"Failed to extract audio: {e}")
         
-def find_offset(within_file, find_file, window):
-    y_within, sr_within = librosa.load(within_file, sr=None)
-    y_find, _ = librosa.load(find_file, sr=sr_within)
+def load_audio(video_path, sample_rate=ANALYSIS_SAMPLE_RATE, duration=None):
+    """
+    Decode a video's audio track as mono float32 PCM straight from an ffmpeg pipe, no temporary files.
+    """
+    absolute_video_path = os.path.abspath(video_path)
+    if not os.path.exists(absolute_video_path):
+        raise FileNotFoundError(f"Video file not found at {absolute_video_path}")
+
+    command = ['ffmpeg', '-v', 'error', '-i', absolute_video_path,
+               '-vn',  # No video output
+               '-ac', '1',  # Downmix to mono
+               '-ar', str(sample_rate),  # Resample to the analysis rate
+               ]
+    if duration is not None:
+        command += ['-t', str(duration)]
+    command += ['-f', 'f32le', 'pipe:1']  # Raw little endian float32 samples on stdout
 
-    # Truncate the find_file audio if necessary
-    y_find = y_find[:sr_within * window] if len(y_find) > sr_within * window else y_find
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to extract audio from {absolute_video_path}: {result.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype='<f4')
+
+def envelope(samples, factor):
+    """
+    Zero-mean amplitude envelope of samples, decimated by `factor`.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    n = len(samples) // factor * factor
+    env = np.abs(samples[:n]).reshape(-1, factor).mean(axis=1)
+    return env - env.mean()
+
+def normalized_correlation(y_within, y_find):
+    """
+    Valid-mode cross-correlation divided by the energy of both signals under each lag, in [-1, 1].
+    """
+    c = signal.correlate(y_within, y_find, mode='valid', method='fft')
+    energy = np.concatenate(([0.0], np.cumsum(np.square(y_within, dtype=np.float64))))
+    window_energy = energy[len(y_find):] - energy[:-len(y_find)]
+    norm = np.sqrt(np.maximum(window_energy, 0) * float(np.dot(y_find, y_find)))
+    return c / np.maximum(norm, 1e-12)
+
+def peak_to_sidelobe_ratio(c, peak, exclusion):
+    """
+    (peak - sidelobe mean) / sidelobe std, with the main lobe of +-exclusion lags left out.
+    """
+    sidelobe = np.concatenate((c[:max(peak - exclusion, 0)], c[peak + exclusion + 1:]))
+    if len(sidelobe) < 2 or sidelobe.std() == 0:
+        return float('inf')
+    return float((c[peak] - sidelobe.mean()) / sidelobe.std())
+
+def parabolic_peak(c, peak):
+    """
+    Sub-sample position of a correlation peak from a parabola through it and its neighbours.
+    """
+    if peak <= 0 or peak >= len(c) - 1:
+        return float(peak)
+    a, b, d = c[peak - 1], c[peak], c[peak + 1]
+    curvature = a - 2 * b + d
+    return float(peak) if curvature == 0 else peak + 0.5 * (a - d) / curvature
+
+def locate_audio(y_within, y_find, sample_rate, window, candidates=COARSE_CANDIDATES, near=None):
+    """
+    Coarse-to-fine offset search returning (offset seconds, peak-to-sidelobe confidence).
+    Decimated envelopes are correlated across the whole reference, then the best coarse
+    peaks are refined at full rate in a small window with parabolic interpolation.
+    An offset already known roughly, e.g. from the landmark index, is passed as near and
+    refined first in place of the weakest coarse peak.
+    """
+    y_within = np.asarray(y_within, dtype=np.float32)
+    y_find = np.asarray(y_find[:sample_rate * window], dtype=np.float32)
+    if len(y_find) == 0 or len(y_within) < len(y_find):
+        raise ValueError("Query audio is empty or longer than the reference audio.")
+
+    factor = max(1, sample_rate // ENVELOPE_RATE)
+    env_within, env_find = envelope(y_within, factor), envelope(y_find, factor)
+    if len(env_find) < 2 or len(env_within) < len(env_find):
+        # too short to decimate, correlate at full rate
+        factor, env_within, env_find = 1, y_within, y_find
+
+    coarse = normalized_correlation(env_within, env_find)
+    exclusion = max(1, ENVELOPE_RATE // 10) if factor > 1 else max(1, sample_rate // 10)
+    confidence = peak_to_sidelobe_ratio(coarse, int(np.argmax(coarse)), exclusion)
+
+    # strongest coarse peaks, at least one main lobe apart
+    peaks = []
+    if near is not None:
+        peaks.append(min(max(int(round(near * sample_rate / factor)), 0), len(coarse) - 1))
+    for lag in np.argsort(-coarse, kind='stable'):
+        if len(peaks) >= candidates:
+            break
+        if all(abs(int(lag) - p) > exclusion for p in peaks):
+            peaks.append(int(lag))
+
+    best_offset, best_score = 0.0, float('-inf')
+    radius = 2 * factor
+    for peak in peaks:
+        lo = max(0, peak * factor - radius)
+        hi = min(len(y_within) - len(y_find), peak * factor + radius)
+        fine = normalized_correlation(y_within[lo:hi + len(y_find)], y_find)
+        fine_peak = int(np.argmax(fine))
+        if fine[fine_peak] > best_score:
+            best_score = fine[fine_peak]
+            best_offset = lo + parabolic_peak(fine, fine_peak)
+
+    return round(best_offset / sample_rate, 2), confidence
+
+def find_audio_offset(y_within, y_find, sample_rate, window, engine='correlate'):
+    """
+    Offset in seconds of the first `window` seconds of y_find within y_within.
+    engine='landmark' votes on spectrogram peak-pair hashes and engine='multires' runs the
+    coarse-to-fine correlator instead of one full-rate cross-correlation.
+    """
+    if engine == 'landmark':
+        return landmark.find_landmark_offset(y_within, y_find, sample_rate, window)
+    if engine == 'multires':
+        return locate_audio(y_within, y_find, sample_rate, window)[0]
+    if engine != 'correlate':
+        raise ValueError(f"Unknown offset engine {engine!r}, expected 'correlate', 'multires' or 'landmark'.")
+
+    # Truncate the find audio if necessary
+    y_find = y_find[:sample_rate * window] if len(y_find) > sample_rate * window else y_find
+    if len(y_find) == 0 or len(y_within) < len(y_find):
+        raise ValueError("Query audio is empty or longer than the reference audio.")
 
     c = signal.correlate(y_within, y_find, mode='valid', method='fft')
     peak = np.argmax(c)
-    offset = round(peak / sr_within, 2)
+    offset = round(peak / sample_rate, 2)
 
     return offset
 
+def find_offset(within_file, find_file, window, engine='correlate'):
+    y_within, sr_within = librosa.load(within_file, sr=None)
+    y_find, _ = librosa.load(find_file, sr=sr_within)
+
+    return find_audio_offset(y_within, y_find, sr_within, window, engine)
+
+def load_video_pair_audio(original_video_path, query_video_path, window, sample_rate, reference_audio=None, query_audio=None):
+    if reference_audio is not None:
+        y_within = np.asarray(reference_audio, dtype=np.float32)
+    else:
+        y_within = load_audio(original_video_path, sample_rate)
+    if query_audio is not None:
+        y_find = np.asarray(query_audio[:sample_rate * window], dtype=np.float32)
+    else:
+        y_find = load_audio(query_video_path, sample_rate, duration=window)
+    return y_within, y_find
+
+def find_video_offset(original_video_path, query_video_path, window, sample_rate=ANALYSIS_SAMPLE_RATE, reference_audio=None, engine='correlate'):
+    """
+    Offset in seconds of the query video's audio within the original video, decoded in memory.
+    reference_audio, e.g. from audio_cache, skips decoding the original; it must be at sample_rate.
+    """
+    y_within, y_find = load_video_pair_audio(original_video_path, query_video_path, window, sample_rate, reference_audio)
+    return find_audio_offset(y_within, y_find, sample_rate, window, engine)
+
+def locate_video(original_video_path, query_video_path, window, sample_rate=ANALYSIS_SAMPLE_RATE, reference_audio=None):
+    """
+    (offset seconds, peak-to-sidelobe confidence) of the query video's audio within the original video.
+    """
+    y_within, y_find = load_video_pair_audio(original_video_path, query_video_path, window, sample_rate, reference_audio)
+    return locate_audio(y_within, y_find, sample_rate, window)
+
 def convert_seconds_to_min_sec(seconds):
     minutes = seconds // 60
     remaining_seconds = round(seconds % 60)
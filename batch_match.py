@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import audio_cache
+import instrumentation
+import pipeline
+import reference_index
+import result_cache
+import thumbnail_store
+
+QUERY_EXTENSIONS = ('.mp4', '.mov', '.mkv', '.avi')
+
+# per-process match context and instrumentation options, set once by the pool initializer
+_context = None
+_profile_dir = None
+_trace_memory = False
+
+def collect_queries(inputs):
+    """
+    Expand query directories and manifests into a list of video paths.
+    A manifest is a text file with one path per line, or JSON lines with a "path" key;
+    relative paths are resolved against the manifest's directory.
+    """
+    queries = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                queries.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(QUERY_EXTENSIONS))
+        elif item.lower().endswith(QUERY_EXTENSIONS):
+            queries.append(item)
+        else:
+            base_dir = os.path.dirname(os.path.abspath(item))
+            with open(item, 'r') as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    path = json.loads(line)['path'] if line.startswith('{') else line
+                    queries.append(os.path.join(base_dir, path))
+    return [os.path.abspath(q) for q in queries]
+
+def init_worker(index_path, landmark_index_dir, video_dir, audio_cache_dir, profile_dir=None, trace_memory=False,
+                result_cache_dir=None, thumbnail_dir=thumbnail_store.DEFAULT_THUMBNAIL_DIR):
+    global _context, _profile_dir, _trace_memory
+    _context = pipeline.MatchContext.load(index_path, landmark_index_dir, video_dir, audio_cache_dir, result_cache_dir, thumbnail_dir)
+    _profile_dir = profile_dir
+    _trace_memory = trace_memory
+
+def run_query(query_video_path):
+    """
+    Match one query inside a pool worker, never raising so one bad clip cannot stop the batch.
+    """
+    start = time.perf_counter()
+    recorder = instrumentation.StageRecorder(_trace_memory, instrumentation.profile_path(_profile_dir, query_video_path))
+    try:
+        result = pipeline.match_query(query_video_path, _context, recorder)
+        result['status'] = 'ok'
+    except Exception as e:
+        result = {'status': 'error', 'error': f"{type(e).__name__}: {e}", 'stages': recorder.finish()}
+    if recorder.profile_path:
+        result['profile'] = recorder.profile_path
+    result['query'] = query_video_path
+    result['total_seconds'] = time.perf_counter() - start
+    return result
+
+def run_batch(queries, output_path, workers=None, index_path=None, landmark_index_dir=audio_cache.DEFAULT_LANDMARK_INDEX_DIR,
+              video_dir='./video', audio_cache_dir=audio_cache.DEFAULT_AUDIO_CACHE_DIR, profile_dir=None, trace_memory=False,
+              result_cache_dir=None, thumbnail_dir=thumbnail_store.DEFAULT_THUMBNAIL_DIR):
+    """
+    Match every query across a process pool, appending one JSON line per result as it completes.
+    """
+    index_path = index_path or reference_index.default_index_path()
+    failures = 0
+    start = time.perf_counter()
+    with open(output_path, 'a') as output, ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker,
+            initargs=(index_path, landmark_index_dir, video_dir, audio_cache_dir, profile_dir, trace_memory,
+                      result_cache_dir, thumbnail_dir)) as executor:
+        futures = [executor.submit(run_query, query) for query in queries]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            failures += result['status'] != 'ok'
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+            print(f"[{done}/{len(queries)}] {result['status']} {result['query']}", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    print(f"Matched {len(queries) - failures}/{len(queries)} queries in {elapsed:.1f}s, results in {output_path}.", file=sys.stderr)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Match query videos headlessly and write JSON lines results.")
+    parser.add_argument('inputs', nargs='+', help="query videos, directories of videos or manifest files")
+    parser.add_argument('--output', default='results.jsonl', help="JSON lines file to append results to (default: results.jsonl)")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument('--index', default=None, help="reference index (default: preprocessing.idx, else preprocessing.json)")
+    parser.add_argument('--landmarks', default=audio_cache.DEFAULT_LANDMARK_INDEX_DIR, help="audio landmark index directory")
+    parser.add_argument('--video-dir', default='./video', help="directory of reference videos (default: ./video)")
+    parser.add_argument('--audio-cache', default=audio_cache.DEFAULT_AUDIO_CACHE_DIR, help="reference audio cache directory")
+    parser.add_argument('--profile-dir', default=None, help="write a cProfile dump per query into this directory")
+    parser.add_argument('--trace-memory', action='store_true', help="record peak traced allocations per stage (slower)")
+    parser.add_argument('--thumbnails', default=thumbnail_store.DEFAULT_THUMBNAIL_DIR, help="reference thumbnail store directory")
+    parser.add_argument('--result-cache', default=result_cache.DEFAULT_RESULT_CACHE_DIR, help="directory of cached match results")
+    parser.add_argument('--no-result-cache', action='store_true', help="always rerun the full pipeline")
+    args = parser.parse_args()
+
+    queries = collect_queries(args.inputs)
+    failures = run_batch(queries, args.output, args.workers, args.index, args.landmarks, args.video_dir, args.audio_cache,
+                         args.profile_dir, args.trace_memory, None if args.no_result_cache else args.result_cache, args.thumbnails)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import wave
+import cv2
+import numpy as np
+import build_index
+import instrumentation
+import pipeline
+
+FPS = 30
+FRAME_SIZE = (320, 180)
+AUDIO_RATE = 44100
+QUERY_DURATION = 12
+
+# ground truth of a generated corpus, written last so a reused --corpus-dir is always scored against
+# the offsets its clips were actually cut at
+TRUTH_FILE = 'truth.json'
+
+# ffmpeg options applied when cutting query clips, cycled over the queries
+QUERY_VARIANTS = {
+    'reencode': [],
+    'scaled': ['-vf', 'scale=iw*3/4:-2'],
+    'noisy': ['-vf', 'noise=alls=12:allf=t', '-af', 'volume=0.6'],
+}
+
+def write_reference_video(path, seed, duration):
+    """
+    Deterministic synthetic reference: scrolling random colour fields that change every 1.5 s,
+    a frame counter, and band-limited noise audio under a random loudness envelope.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = FRAME_SIZE
+    video_tmp = f"{path}.video.avi"
+    audio_tmp = f"{path}.audio.wav"
+
+    writer = cv2.VideoWriter(video_tmp, cv2.VideoWriter_fourcc(*'MJPG'), FPS, FRAME_SIZE)
+    for i in range(duration * FPS):
+        if i % 45 == 0:
+            field = cv2.resize(rng.integers(0, 255, (9, 16, 3), dtype=np.uint8), FRAME_SIZE, interpolation=cv2.INTER_CUBIC)
+        frame = np.roll(field, (i % 45) * 2, axis=1)
+        cv2.putText(frame, str(i), (10, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        writer.write(frame)
+    writer.release()
+
+    samples = np.convolve(rng.standard_normal(duration * AUDIO_RATE), np.ones(20) / 20, 'same')
+    loudness = np.repeat(rng.random(duration * 10), AUDIO_RATE // 10)[:len(samples)]
+    samples = samples * loudness
+    pcm = (samples / np.abs(samples).max() * 30000).astype(np.int16)
+    with wave.open(audio_tmp, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(AUDIO_RATE)
+        wav_file.writeframes(pcm.tobytes())
+
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-i', video_tmp, '-i', audio_tmp, '-c:v', 'mpeg4', '-q:v', '3',
+                    '-c:a', 'aac', '-shortest', path], check=True)
+    os.remove(video_tmp)
+    os.remove(audio_tmp)
+
+def cut_query(reference_path, query_path, offset_seconds, variant):
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', '-ss', str(offset_seconds), '-i', reference_path, '-t', str(QUERY_DURATION),
+                    *QUERY_VARIANTS[variant], '-c:v', 'mpeg4', '-q:v', '5', '-c:a', 'aac', query_path], check=True)
+
+def build_corpus(corpus_dir, references, queries_per_reference, duration, seed):
+    """
+    Generate references and query clips and return the ground truth, or load both from a corpus
+    generated earlier with the same options.
+    """
+    config = {'references': references, 'queries_per_reference': queries_per_reference, 'duration': duration, 'seed': seed}
+    video_dir = os.path.join(corpus_dir, 'video')
+    query_dir = os.path.join(corpus_dir, 'queries')
+    truth_path = os.path.join(corpus_dir, TRUTH_FILE)
+    if os.path.exists(truth_path):
+        with open(truth_path, 'r') as truth_file:
+            stored = json.load(truth_file)
+        if stored['config'] != config:
+            raise ValueError(f"{corpus_dir} holds a corpus generated with {stored['config']}, "
+                             f"pass the same options or another --corpus-dir.")
+        return [dict(expected, query=os.path.join(corpus_dir, expected['query'])) for expected in stored['truth']]
+    for directory in (video_dir, query_dir):
+        if os.path.isdir(directory) and os.listdir(directory):
+            raise ValueError(f"{directory} is not empty but {truth_path} is missing, its ground truth is unknown.")
+
+    os.makedirs(video_dir, exist_ok=True)
+    os.makedirs(query_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    variants = list(QUERY_VARIANTS)
+
+    truth = []
+    for r in range(references):
+        name = f"reference{r:03d}.mp4"
+        reference_path = os.path.join(video_dir, name)
+        write_reference_video(reference_path, seed * 1000 + r, duration)
+        for q in range(queries_per_reference):
+            # whole frames only, so the expected frame index is exact
+            offset_seconds = int(rng.integers(0, (duration - QUERY_DURATION) * FPS)) / FPS
+            variant = variants[(r * queries_per_reference + q) % len(variants)]
+            query_path = os.path.join(query_dir, f"query{r:03d}_{q:02d}_{variant}.mp4")
+            cut_query(reference_path, query_path, offset_seconds, variant)
+            truth.append({'query': query_path, 'video': name, 'offset_seconds': offset_seconds, 'variant': variant})
+
+    tmp_path = f"{truth_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as truth_file:
+        json.dump({'config': config, 'truth': [dict(expected, query=os.path.relpath(expected['query'], corpus_dir))
+                                               for expected in truth]}, truth_file, indent=1)
+    os.replace(tmp_path, truth_path)
+    return truth
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+            'p90': float(np.percentile(values, 90)), 'p99': float(np.percentile(values, 99)), 'max': float(values.max())}
+
+def run_benchmark(corpus_dir, references=4, queries_per_reference=3, duration=60, seed=0, trace_memory=False):
+    """
+    Build the corpus and its index, match every query and summarise latency, throughput, memory and accuracy.
+    """
+    start = time.perf_counter()
+    truth = build_corpus(corpus_dir, references, queries_per_reference, duration, seed)
+    corpus_seconds = time.perf_counter() - start
+
+    index_path = os.path.join(corpus_dir, 'reference.idx')
+    audio_cache_dir = os.path.join(corpus_dir, 'audio_cache')
+    landmark_index_dir = os.path.join(corpus_dir, 'landmark_index')
+    thumbnail_dir = os.path.join(corpus_dir, 'thumbnails')
+    start = time.perf_counter()
+    build_index.build_index(os.path.join(corpus_dir, 'video'), index_path, audio_cache_dir=audio_cache_dir,
+                            landmark_index_dir=landmark_index_dir, thumbnail_dir=thumbnail_dir)
+    index_seconds = time.perf_counter() - start
+
+    context = pipeline.MatchContext.load(index_path, landmark_index_dir, os.path.join(corpus_dir, 'video'), audio_cache_dir,
+                                         thumbnail_dir=thumbnail_dir)
+    results = []
+    start = time.perf_counter()
+    for expected in truth:
+        recorder = instrumentation.StageRecorder(trace_memory)
+        result = pipeline.match_query(expected['query'], context, recorder)
+        # process_videos reports frame numbers one below the 0-based frame at the offset
+        expected_frame = int(round(expected['offset_seconds'] * FPS)) - 1
+        result.update({
+            'query': os.path.relpath(expected['query'], corpus_dir),
+            'variant': expected['variant'],
+            'expected_video': expected['video'],
+            'expected_offset_seconds': expected['offset_seconds'],
+            'identified': result['video'] == expected['video'],
+            'offset_error_seconds': result['offset_seconds'] - expected['offset_seconds'],
+            'frame_index_error': result['frame_index'] - expected_frame,
+        })
+        results.append(result)
+    match_seconds = time.perf_counter() - start
+
+    stage_names = list(results[0]['stages']) if results else []
+    summary = {
+        'stages': {name: percentiles([r['stages'][name]['wall_seconds'] for r in results if name in r['stages']])
+                   for name in stage_names},
+        'end_to_end': percentiles([sum(r['timings'].values()) for r in results]),
+        'throughput_queries_per_second': len(results) / match_seconds,
+        'max_rss_bytes': instrumentation.max_rss_bytes(),
+        'accuracy': {
+            'identification': float(np.mean([r['identified'] for r in results])),
+            'mean_abs_offset_error_seconds': float(np.mean([abs(r['offset_error_seconds']) for r in results])),
+            'mean_abs_frame_index_error': float(np.mean([abs(r['frame_index_error']) for r in results])),
+            'exact_frame_rate': float(np.mean([r['frame_index_error'] == 0 for r in results])),
+        },
+    }
+    if trace_memory:
+        summary['peak_traced_bytes'] = {name: max(r['stages'][name].get('peak_traced_bytes', 0) for r in results if name in r['stages'])
+                                        for name in stage_names}
+
+    return {
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpu_count': os.cpu_count()},
+        'config': {'references': references, 'queries_per_reference': queries_per_reference, 'duration': duration,
+                   'seed': seed, 'query_duration': QUERY_DURATION, 'frame_size': FRAME_SIZE, 'fps': FPS},
+        'setup_seconds': {'corpus': corpus_seconds, 'index': index_seconds},
+        'summary': summary,
+        'queries': results,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matching pipeline on a synthetic reference/query corpus.")
+    parser.add_argument('--corpus-dir', default=None, help="where to generate (and reuse) the corpus (default: a temporary directory)")
+    parser.add_argument('--references', type=int, default=4)
+    parser.add_argument('--queries-per-reference', type=int, default=3)
+    parser.add_argument('--duration', type=int, default=60, help="reference length in seconds (default: 60)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--trace-memory', action='store_true', help="record peak traced allocations per stage (slower)")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON report path (default: benchmark_results.json)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = run_benchmark(args.corpus_dir or tmp_dir, args.references, args.queries_per_reference,
+                               args.duration, args.seed, args.trace_memory)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(json.dumps(report['summary'], indent=2))
+    print(f"Full report written to {args.output}.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import audio_cache
+import find_similar_video
+import reference_index
+import thumbnail_store
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.mkv', '.avi')
+
+def find_reference_videos(video_dir):
+    """
+    Walk the reference directory and return {index name: absolute path} for every video file.
+    Names are relative to video_dir so they can be joined back onto it by the app.
+    """
+    videos = {}
+    for root, _, files in os.walk(video_dir):
+        for file_name in files:
+            if file_name.lower().endswith(VIDEO_EXTENSIONS):
+                path = os.path.join(root, file_name)
+                name = os.path.relpath(path, video_dir).replace(os.sep, '/')
+                videos[name] = os.path.abspath(path)
+    return dict(sorted(videos.items()))
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+def fingerprint_video(name, path, step, audio_cache_dir=None, thumbnail_dir=None):
+    """
+    Fingerprint one reference video, runs inside a pool worker.
+    With audio_cache_dir set the video's analysis-rate audio is cached there as well (or recorded
+    as missing), with thumbnail_dir set its grayscale frame thumbnails are stored for frame alignment.
+    """
+    signature = file_signature(path)
+    if thumbnail_dir is not None:
+        # one decode pass yields both the thumbnail of every frame and the hash of every step-th one
+        frame_hashes = []
+        def hash_sampled_frame(frame_index, frame):
+            if frame_index % step == 0:
+                frame_hashes.append(find_similar_video.get_frame_hash(frame))
+        thumbnail_store.build_thumbnails(name, path, thumbnail_dir, on_frame=hash_sampled_frame)
+    else:
+        frame_hashes = find_similar_video.extract_frame_hashes(path, step)
+    hashes = find_similar_video.pack_hashes(frame_hashes)
+    if audio_cache_dir is not None:
+        try:
+            audio_cache.build_reference_audio(name, path, audio_cache_dir)
+        except RuntimeError as e:
+            # a reference without an audio track is still matched by its frame hashes
+            print(f"{name} has no usable audio, indexing its frames only.")
+            audio_cache.mark_no_audio(name, str(e), audio_cache_dir)
+    return dict(name=name, step=step, **signature), hashes
+
+def load_existing_entries(index_path):
+    """
+    Return {name: (metadata, hashes)} from an existing index, or an empty dict if there is none.
+    """
+    if not os.path.exists(index_path):
+        return {}
+    index = reference_index.load_index(index_path)
+    # copy the hashes out so the old file can be replaced underneath the mapping
+    return {video['name']: (video, index.hashes[index.offsets[i]:index.offsets[i + 1]].copy())
+            for i, video in enumerate(index.videos)}
+
+def is_unchanged(metadata, path, step, audio_cache_dir=None, thumbnail_dir=None):
+    signature = file_signature(path)
+    if audio_cache_dir is not None and not audio_cache.has_reference_audio(metadata['name'], audio_cache_dir):
+        return False
+    if thumbnail_dir is not None and not thumbnail_store.has_thumbnails(metadata['name'], thumbnail_dir):
+        return False
+    return (metadata.get('mtime') == signature['mtime'] and metadata.get('size') == signature['size']
+            and metadata.get('step') == step)
+
+def build_index(video_dir, index_path, step=30, workers=None, force=False, audio_cache_dir=audio_cache.DEFAULT_AUDIO_CACHE_DIR,
+                landmark_index_dir=audio_cache.DEFAULT_LANDMARK_INDEX_DIR, thumbnail_dir=thumbnail_store.DEFAULT_THUMBNAIL_DIR):
+    """
+    Fingerprint every reference video in parallel and atomically write the merged index.
+    Videos whose mtime, size and sampling step are unchanged (and whose audio and thumbnails are
+    stored, when audio_cache_dir and thumbnail_dir are set) reuse their existing hashes.
+    """
+    videos = find_reference_videos(video_dir)
+    existing = load_existing_entries(index_path)
+
+    entries = {}
+    pending = {}
+    for name, path in videos.items():
+        if not force and name in existing and is_unchanged(existing[name][0], path, step, audio_cache_dir, thumbnail_dir):
+            entries[name] = existing[name]
+        else:
+            pending[name] = path
+
+    print(f"{len(videos)} reference videos, {len(entries)} unchanged, {len(pending)} to fingerprint.")
+    start = time.perf_counter()
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fingerprint_video, name, path, step, audio_cache_dir, thumbnail_dir): name for name, path in pending.items()}
+            for done, future in enumerate(as_completed(futures), 1):
+                name = futures[future]
+                try:
+                    entries[name] = future.result()
+                except Exception as e:
+                    # keep the previous fingerprint, if any, rather than dropping the video
+                    print(f"Failed to fingerprint {name}: {e}")
+                    if name in existing:
+                        entries[name] = existing[name]
+                    continue
+                print(f"[{done}/{len(pending)}] {name}: {len(entries[name][1])} hashes")
+
+    reference_index.write_index(index_path, [entries[name] for name in sorted(entries)])
+    print(f"Wrote {len(entries)} videos to {index_path} in {time.perf_counter() - start:.1f}s.")
+    if audio_cache_dir is not None and landmark_index_dir is not None:
+        audio_cache.build_landmark_index(sorted(entries), landmark_index_dir, audio_cache_dir)
+        print(f"Wrote the audio landmark index to {landmark_index_dir}.")
+    return index_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the reference frame hash index from a directory of videos.")
+    parser.add_argument('--video-dir', default='./video', help="directory of reference videos (default: ./video)")
+    parser.add_argument('--index', default=reference_index.DEFAULT_INDEX_PATH, help="binary index to write")
+    parser.add_argument('--step', type=int, default=30, help="hash every Nth frame (default: 30)")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="re-fingerprint every video")
+    parser.add_argument('--audio-cache', default=audio_cache.DEFAULT_AUDIO_CACHE_DIR,
+                        help="directory for cached reference audio (default: ./audio_cache)")
+    parser.add_argument('--landmarks', default=audio_cache.DEFAULT_LANDMARK_INDEX_DIR,
+                        help="directory for the audio landmark index (default: ./landmark_index)")
+    parser.add_argument('--no-audio', action='store_true', help="do not build the reference audio cache or landmark index")
+    parser.add_argument('--thumbnails', default=thumbnail_store.DEFAULT_THUMBNAIL_DIR,
+                        help="directory for the reference frame thumbnails (default: ./thumbnails); every frame is "
+                             "kept at 128 px wide, about 1 GB per hour of 16:9 video at 30 fps")
+    parser.add_argument('--no-thumbnails', action='store_true', help="do not build the reference thumbnail store")
+    args = parser.parse_args()
+    build_index(args.video_dir, args.index, args.step, args.workers, args.force,
+                None if args.no_audio else args.audio_cache, args.landmarks,
+                None if args.no_thumbnails else args.thumbnails)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import cv2
+import numpy as np
+from collections import namedtuple
+
+# same constants as skimage.metrics.structural_similarity on uint8 grayscale frames
+WIN_SIZE = 7
+DATA_RANGE = 255
+C1 = (0.01 * DATA_RANGE) ** 2
+C2 = (0.03 * DATA_RANGE) ** 2
+COV_NORM = WIN_SIZE ** 2 / (WIN_SIZE ** 2 - 1)  # sample covariance
+PAD = (WIN_SIZE - 1) // 2
+# pixels are stored centred on mid-grey, covariance is shift invariant and the smaller
+# magnitudes keep the float32 cross term accurate
+CENTRE = 128.0
+
+# per-frame terms that do not depend on the frame it is compared with: the centred float32 pixels
+# (ready for the cross term) plus the local mean and variance, kept only for the interior that SSIM
+# averages over (the filter radius strip is ignored) - 12 bytes per pixel. Each field is one frame
+# (H, W) or, from stack_statistics, a stack of frames (N, H, W) scored in one pass by batched_ssim.
+FrameStats = namedtuple('FrameStats', ['pixels', 'mean', 'variance'])
+
+# frames per vectorized pass: the per-pair arithmetic is memory bound, and larger batches fall
+# out of the CPU cache and run slower than this
+BATCH_FRAMES = 4
+
+def _box_mean(image, dst=None):
+    return cv2.boxFilter(image, -1, (WIN_SIZE, WIN_SIZE), dst=dst, normalize=True, borderType=cv2.BORDER_REFLECT)
+
+def _crop(image):
+    return image[..., PAD:image.shape[-2] - PAD, PAD:image.shape[-1] - PAD]
+
+def frame_statistics(gray_frame):
+    """
+    Precompute the local mean and variance of a grayscale uint8 frame once.
+    """
+    pixels = gray_frame.astype(np.float32) - CENTRE
+    wide = pixels.astype(np.float64)  # the squared box mean needs double precision, only while computing
+    mean = _box_mean(wide)
+    variance = COV_NORM * (_box_mean(wide * wide) - mean * mean)
+    return FrameStats(pixels,
+                      _crop(mean + CENTRE).astype(np.float32),
+                      _crop(variance).astype(np.float32))
+
+def stack_statistics(frame_stats):
+    """
+    One FrameStats of (N, H, W) arrays from a sequence of per-frame FrameStats.
+    """
+    return FrameStats(*(np.stack(field) for field in zip(*frame_stats)))
+
+def batched_ssim(original_stats, query_stats):
+    """
+    Mean SSIM of every frame pair of two stacked FrameStats, as one float64 array.
+    Either side may be a single (H, W) frame, which is compared with every frame of the other.
+    Pairs are scored BATCH_FRAMES at a time: the cross products of a batch are box filtered in one
+    call, as a single tall image, which is exact on every frame's interior rows since the window
+    never reaches the neighbouring frame from there, and the SSIM map is computed on the whole
+    (N, H, W) batch in reused scratch buffers.
+    """
+    ux, vx, x = original_stats.mean, original_stats.variance, original_stats.pixels
+    uy, vy, y = query_stats.mean, query_stats.variance, query_stats.pixels
+    count = max(1 if x.ndim == 2 else len(x), 1 if y.ndim == 2 else len(y))
+    scores = np.empty(count, dtype=np.float64)
+    if count == 0:
+        return scores
+
+    height, width = x.shape[-2:]
+    size = min(BATCH_FRAMES, count)
+    cross = np.empty((size, height, width), dtype=np.float32)
+    filtered = np.empty((size * height, width), dtype=np.float32)
+    first, second, third = (np.empty((size,) + ux.shape[-2:], dtype=np.float32) for _ in range(3))
+
+    for start in range(0, count, BATCH_FRAMES):
+        batch = slice(start, start + BATCH_FRAMES)
+        n = min(BATCH_FRAMES, count - start)
+        # single frames broadcast against the batch of the other side
+        bx, bux, bvx = (a if a.ndim == 2 else a[batch] for a in (x, ux, vx))
+        by, buy, bvy = (a if a.ndim == 2 else a[batch] for a in (y, uy, vy))
+        a, b, c = first[:n], second[:n], third[:n]
+
+        np.multiply(bx, by, out=cross[:n])
+        uxy = _crop(_box_mean(cross[:n].reshape(n * height, width), filtered[:n * height]).reshape(n, height, width))
+        # numerator (2 ux uy + C1) (2 vxy + C2), with vxy = COV_NORM (uxy - (ux - CENTRE) (uy - CENTRE))
+        np.subtract(bux, CENTRE, out=a)
+        np.subtract(buy, CENTRE, out=b)
+        a *= b
+        np.subtract(uxy, a, out=a)
+        a *= 2 * COV_NORM
+        a += C2
+        np.multiply(bux, buy, out=b)
+        b *= 2
+        b += C1
+        a *= b
+        # denominator (ux^2 + uy^2 + C1) (vx + vy + C2)
+        np.multiply(bux, bux, out=b)
+        np.multiply(buy, buy, out=c)
+        b += c
+        b += C1
+        np.add(bvx, bvy, out=c)
+        c += C2
+        b *= c
+        a /= b
+        scores[batch] = a.reshape(n, -1).mean(axis=1, dtype=np.float64)
+    return scores
+
+def pair_ssim(original_stats, query_stats):
+    """
+    Mean SSIM of one frame pair from precomputed statistics.
+    """
+    return float(batched_ssim(original_stats, query_stats)[0])
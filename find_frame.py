@@ -1,77 +1,252 @@
 import cv2
 import numpy as np
-from skimage.metrics import structural_similarity as ssim
+from collections import deque
+import fast_ssim
+import instrumentation
+import thumbnail_store
 import audiofingerprint # audio fingerprint gets - hit first
 import find_similar_video
-from moviepy.editor import VideoFileClip
 import subprocess
 import json
 
-def get_video_frames(video_path):
+def resize_frame(frame, target_width, target_height):
     """
-    Load frames from a given video file.
+    Resize a frame to specified dimensions.
     """
-    cap = cv2.VideoCapture(video_path)
-    frames = []
+    return cv2.resize(frame, (target_width, target_height))
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frames.append(frame)
+def to_working_frame(frame, size=None):
+    """
+    Resize a BGR frame to (width, height) if needed and convert it to grayscale.
+    """
+    if size is not None and (frame.shape[1], frame.shape[0]) != size:
+        frame = resize_frame(frame, size[0], size[1])
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-    cap.release()
-    return frames
+def iter_working_frames(video_path, size=None, start_time=0, end_time=None):
+    """
+    Decode a video one frame at a time, yielding grayscale frames at the working size.
+    Only the [start_time, end_time) window in seconds is decoded, the reader seeks to its start.
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        frame_index = int(round(start_time * fps))
+        if frame_index > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        end_frame = int(round(end_time * fps)) if end_time is not None else None
 
-def resize_frame(frame, target_width, target_height):
+        while cap.isOpened() and (end_frame is None or frame_index < end_frame):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield to_working_frame(frame, size)
+            frame_index += 1
+    finally:
+        cap.release()
+
+def working_size(video_path, working_width=None):
     """
-    Resize a frame to specified dimensions.
+    Working (width, height) of a video, optionally downscaled to working_width keeping the aspect ratio.
     """
-    return cv2.resize(frame, (target_width, target_height))
+    cap = cv2.VideoCapture(video_path)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    if working_width is None or working_width >= width:
+        return (width, height)
+    return (working_width, max(1, int(round(height * working_width / width))))
 
-def compare_frames(frame1, frame2):
+def working_frames(original_video_path, query_video_path, working_width, original_range, query_range, thumbnails=None):
     """
-    Compare two frames using SSIM.
+    (query frames, original frames) as grayscale frames of a common working size.
+    With the reference video's stored thumbnails the original window is read from the store by
+    frame range and the query is downscaled to the thumbnail size, so only the query is decoded.
     """
-    # Ensure frames have the same size
-    if frame1.shape != frame2.shape:
-        frame1 = resize_frame(frame1, frame2.shape[1], frame2.shape[0])
-    
-    # Convert frames to grayscale
-    frame1_gray = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-    frame2_gray = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
-    
-    # Calculate SSIM between the grayscale frames
-    ssim_value, _ = ssim(frame1_gray, frame2_gray, full=True)
-    
-    return ssim_value
+    if thumbnails is not None:
+        query_frames = (thumbnail_store.to_thumbnail(frame, thumbnails.size)
+                        for frame in iter_working_frames(query_video_path, None, *query_range))
+        return query_frames, thumbnails.frame_range(*original_range)
+    size = working_size(query_video_path, working_width)
+    return iter_working_frames(query_video_path, size, *query_range), iter_working_frames(original_video_path, size, *original_range)
 
-def find_best_match(original_video_path, query_video_path):
+def find_best_match(original_video_path, query_video_path, working_width=None, original_range=(0, None), query_range=(0, None),
+                    recorder=None, thumbnails=None):
     """
     Find the most likely frame where the query video starts in the original video.
+    Original frames are streamed through a ring buffer as long as the query, so only the query
+    and one window of grayscale frames at the working size are ever held in memory. Each frame's
+    SSIM mean and variance are computed once and every window is scored in one batched pass.
+    Frames are scored at the query's native resolution; every buffered frame costs 12 bytes per pixel
+    of SSIM statistics (several gigabytes for a 10 second 720p window), so pass working_width
+    (e.g. 320) to downscale both sides and cap memory, at the cost of slightly different scores.
+    original_range and query_range are (start, end) seconds to decode, the index is relative to the original start.
+    Decoding and scoring are interleaved, so a recorder sees them as one 'frame_match' stage.
+    With thumbnails (a thumbnail_store.ReferenceThumbnails) the original side comes from the store
+    and working_width is unused.
     """
-    original_frames = get_video_frames(original_video_path)
-    query_frames = get_video_frames(query_video_path)
+    with instrumentation.stage(recorder, 'frame_match'):
+        return _find_best_match(*working_frames(original_video_path, query_video_path, working_width, original_range,
+                                                query_range, thumbnails))
+
+def _stats_range(stats, start, end):
+    return fast_ssim.FrameStats(*(field[start:end] for field in stats))
 
+def _find_best_match(query_frames, original_frames):
+    query_stats = [fast_ssim.frame_statistics(frame) for frame in query_frames]
+    if not query_stats:
+        return -1
+    query_stats = fast_ssim.stack_statistics(query_stats)
+    length = len(query_stats.pixels)
+
+    # ring buffer of the last `length` original frames, frame i is kept in slot i % length
+    window = None
     best_match_index = -1
     best_match_score = float('-inf')
 
-    # Loop over the original video frames and compare them with the query video frames
-    for i in range(len(original_frames) - len(query_frames) + 1):
-        match_score = 0
-        
-        # Compare each frame pair-wise and accumulate the SSIM score
-        for j in range(len(query_frames)):
-            score = compare_frames(original_frames[i + j], query_frames[j])
-            match_score += score
-        
+    # Slide the query over the original as frames are decoded, window i ends at frame i + len(query) - 1
+    for frame_number, original_frame in enumerate(original_frames):
+        stats = fast_ssim.frame_statistics(original_frame)
+        if window is None:
+            window = fast_ssim.FrameStats(*(np.empty((length,) + field.shape, dtype=field.dtype) for field in stats))
+        for field, value in zip(window, stats):
+            field[frame_number % length] = value
+        if frame_number < length - 1:
+            continue
+
+        # the window starts in slot `start` and wraps around: slots [start, length) pair with the
+        # first query frames and slots [0, start) with the rest, both scored as whole batches
+        start = (frame_number + 1) % length
+        match_score = (fast_ssim.batched_ssim(_stats_range(window, start, length), _stats_range(query_stats, 0, length - start)).sum()
+                       + fast_ssim.batched_ssim(_stats_range(window, 0, start), _stats_range(query_stats, length - start, length)).sum())
+
         # Normalize match score by the number of frames in the query video
-        match_score /= len(query_frames)
-        
+        match_score /= length
+
         # Update the best match
         if match_score > best_match_score:
             best_match_score = match_score
-            best_match_index = i
+            best_match_index = frame_number - length + 1
+
+    print(f"The most likely frame where the query video starts is frame {best_match_index} with an average similarity score of {best_match_score}.")
+    return best_match_index
+
+def thumbnail_size(frame, thumbnail_width):
+    """
+    (width, height) of a frame downscaled to thumbnail_width, never below the SSIM window.
+    """
+    height, width = frame.shape[:2]
+    thumbnail_width = max(fast_ssim.WIN_SIZE, min(thumbnail_width, width))
+    return (thumbnail_width, max(fast_ssim.WIN_SIZE, int(round(height * thumbnail_width / width))))
+
+def thumbnail_statistics(frame, size):
+    return fast_ssim.frame_statistics(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+
+def window_score(original_stats, query_stats, offset, query_indices, threshold=None, chunk_size=8):
+    """
+    Average SSIM of the query frames at query_indices against the original window starting at offset.
+    Returns None as soon as the partial score shows the window cannot beat threshold, SSIM never exceeds 1.
+    """
+    total = 0.0
+    for start in range(0, len(query_indices), chunk_size):
+        indices = query_indices[start:start + chunk_size]
+        total += fast_ssim.batched_ssim(fast_ssim.stack_statistics([original_stats[offset + j] for j in indices]),
+                                        fast_ssim.stack_statistics([query_stats[j] for j in indices])).sum()
+        remaining = len(query_indices) - start - len(indices)
+        if threshold is not None and (total + remaining) / len(query_indices) <= threshold:
+            return None
+    return total / len(query_indices)
+
+def find_best_match_coarse_to_fine(original_video_path, query_video_path, working_width=None, original_range=(0, None),
+                                   query_range=(0, None), thumbnail_width=80, query_stride=5, refine_top=3, recorder=None,
+                                   thumbnails=None):
+    """
+    Hierarchical, heuristic version of find_best_match.
+    Every offset is first scored on thumbnails using every query_stride-th query frame, dropping
+    offsets whose partial score cannot reach the current top candidates. The refine_top best offsets
+    and their direct neighbours are then rescored at the working resolution on every query frame.
+    It usually agrees with find_best_match, but an offset that misses the thumbnail shortlist is
+    never rescored, so the exact answer is not guaranteed.
+    With stored reference thumbnails the working resolution is the store's.
+    The original is streamed through the coarse pass like find_best_match's ring buffer, keeping only
+    the grayscale frames the current window or a shortlisted candidate can still need for the fine pass.
+    """
+    with instrumentation.stage(recorder, 'frame_decode'):
+        query_frames, original_frames = working_frames(original_video_path, query_video_path, working_width, original_range,
+                                                       query_range, thumbnails)
+        query_frames = list(query_frames)
+    if not query_frames:
+        return -1
+
+    with instrumentation.stage(recorder, 'frame_match'):
+        return _coarse_to_fine_search(query_frames, original_frames, thumbnail_width, query_stride, refine_top)
+
+def _coarse_to_fine_search(query_frames, original_frames, thumbnail_width, query_stride, refine_top):
+    # both sides are at the working size, so they share one thumbnail size
+    size = thumbnail_size(query_frames[0], thumbnail_width)
+    query_thumbnails = [thumbnail_statistics(frame, size) for frame in query_frames]
+    length = len(query_frames)
+    kept_frames = {}
+    window = deque(maxlen=length)
+
+    def needed(index, offset, top):
+        # a later candidate or its left neighbour starts at offset - 1 at the earliest,
+        # a shortlisted candidate c and its neighbours read frames c - 1 to c + length
+        return index >= offset - 1 or any(c - 1 <= index <= c + length for _, c in top)
+
+    # coarse pass as the original is decoded, keep the refine_top best thumbnail scores
+    sparse_indices = list(range(0, length, query_stride))
+    top = []
+    frame_count = 0
+    for frame_number, original_frame in enumerate(original_frames):
+        frame_count += 1
+        kept_frames[frame_number] = original_frame
+        window.append(thumbnail_statistics(original_frame, size))
+        if len(window) < length:
+            continue
+        offset = frame_number - length + 1
+        threshold = top[-1][0] if len(top) == refine_top else None
+        score = window_score(window, query_thumbnails, 0, sparse_indices, threshold)
+        if score is not None:
+            previous = top
+            top = sorted(top + [(score, offset)], key=lambda x: -x[0])[:refine_top]
+            if len(previous) == refine_top:
+                # a candidate left the shortlist, its frames are no longer needed
+                for i in [i for i in kept_frames if not needed(i, offset, top)]:
+                    del kept_frames[i]
+        # the frame that just fell out of reach of any new candidate
+        if offset - 2 in kept_frames and not needed(offset - 2, offset, top):
+            del kept_frames[offset - 2]
+    offsets = frame_count - length + 1
+    if offsets <= 0:
+        return -1
+
+    # fine pass over every candidate at once, one query frame at a time, so only that frame's statistics
+    # and the original frames some candidate window still has ahead of it are held
+    candidates = sorted({o for _, candidate in top for o in (candidate - 1, candidate, candidate + 1) if 0 <= o < offsets})
+    totals = dict.fromkeys(candidates, 0.0)
+    original_stats = {}
+    for j, query_frame in enumerate(query_frames):
+        for offset in candidates:
+            if offset + j not in original_stats:
+                original_stats[offset + j] = fast_ssim.frame_statistics(kept_frames[offset + j])
+        # every candidate's frame against this query frame in one batch
+        scores = fast_ssim.batched_ssim(fast_ssim.stack_statistics([original_stats[offset + j] for offset in candidates]),
+                                        fast_ssim.frame_statistics(query_frame))
+        for offset, score in zip(candidates, scores):
+            totals[offset] += score
+        # the earliest candidate reads frame candidates[0] + j + 1 next, nothing below it is needed again
+        for i in [i for i in original_stats if i <= candidates[0] + j]:
+            del original_stats[i]
+
+    # candidates in frame order, so ties resolve to the earliest offset like the full scan
+    best_match_index = -1
+    best_match_score = float('-inf')
+    for offset in candidates:
+        score = totals[offset] / len(query_frames)
+        if score > best_match_score:
+            best_match_score = score
+            best_match_index = offset
 
     print(f"The most likely frame where the query video starts is frame {best_match_index} with an average similarity score of {best_match_score}.")
     return best_match_index
@@ -90,9 +265,12 @@ def get_video_duration(file_path):
     duration = float(metadata["format"]["duration"])
     return duration
 
-def process_videos(input_video_path, query_video_path, total_seconds):
+def process_videos(input_video_path, query_video_path, total_seconds, coarse_to_fine=False, recorder=None, thumbnails=None):
     """
     Process videos to find the best match frame.
+    The default is find_best_match's exhaustive sweep at the working resolution, coarse_to_fine=True
+    trades its guarantee for the faster thumbnail-first heuristic search.
+    With the reference video's stored thumbnails only the query is decoded.
     """
     # video_path = "./video/"
     # origin_video = find_similar_video.most_similar_video
@@ -105,17 +283,12 @@ def process_videos(input_video_path, query_video_path, total_seconds):
     start_time = max(start_time, 0)
     end_time = start_time + video_cut_duration + 4
 
-    output_video_path = "output_video.mp4"
-    video = VideoFileClip(input_video_path)
-    video_cut = video.subclip(start_time, end_time)
-    video_cut.write_videofile(output_video_path, codec="libx264")
-
-    output_query_video_path = "output_query_video.mp4"
-    video = VideoFileClip(query_video_path)
-    video_cut = video.subclip(0, video_cut_duration)
-    video_cut.write_videofile(output_query_video_path, codec="libx264")
-
-    frame = find_best_match(output_video_path, output_query_video_path)
+    # decode both windows straight from the sources instead of re-encoding cuts to disk
+    match = find_best_match_coarse_to_fine if coarse_to_fine else find_best_match
+    frame = match(input_video_path, query_video_path,
+                  original_range=(start_time, end_time),
+                  query_range=(0, video_cut_duration),
+                  recorder=recorder, thumbnails=thumbnails)
     frame_num = int(start_time * 30 + frame) - 1
     return frame_num
 
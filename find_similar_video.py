@@ -1,6 +1,19 @@
-import json
+import itertools
 import cv2
 import numpy as np
+import hamming
+import multi_index
+import reference_index
+
+# progressive identification stops decoding once the leader's mean similarity beats the runner-up by
+# this much (about 10 of 64 bits per frame), after at least EARLY_EXIT_MIN_FRAMES sampled frames
+EARLY_EXIT_MARGIN = 0.15
+EARLY_EXIT_MIN_FRAMES = 3
+
+# multi-index shortlist used by the matching pipeline: score only the SHORTLIST_TOP_K best voted
+# videos, probing sub-blocks at SHORTLIST_RADIUS (votes within 7 bits of a query hash at radius 1)
+SHORTLIST_TOP_K = 8
+SHORTLIST_RADIUS = 1
 
 # Function to get frame hash
  
@@ -10,54 +23,208 @@ def get_frame_hash(frame):
     resized_frame = cv2.resize(gray_frame, (8, 8))
 
     diff = resized_frame > np.mean(resized_frame)
-    frame_hash = "".join(["1" if val else "0" for val in diff.flatten()])
+    # pack the 64 comparison bits into one integer, first pixel is the most significant bit
+    frame_hash = int.from_bytes(np.packbits(diff.flatten()).tobytes(), 'big')
     return frame_hash
 
-# Extract frame hashes from a video
-def extract_frame_hashes(video_path, step=30):
-    frame_hashes = []
+def hash_from_string(hash_string):
+    """
+    Convert a legacy '0'/'1' hash string into its packed integer form.
+    """
+    return int(hash_string, 2)
+
+def pack_hashes(hashes):
+    """
+    Pack a list of hashes (integers or legacy '0'/'1' strings) into a uint64 array.
+    """
+    return np.array([hash_from_string(h) if isinstance(h, str) else h for h in hashes], dtype=np.uint64)
+
+def sampling_step(video, step=30, interval_seconds=None):
+    """
+    Frame step for a sampling interval in seconds, falling back to `step` when the fps is unknown.
+    """
+    if interval_seconds is None:
+        return step
+    fps = video.get(cv2.CAP_PROP_FPS)
+    if fps <= 0:
+        return step
+    return max(1, int(round(fps * interval_seconds)))
+
+def iter_sampled_frames(video_path, step=30, interval_seconds=None, seek=False):
+    """
+    Yield every `step`-th frame (or one frame per `interval_seconds`) of a video.
+    Skipped frames are only grabbed, never converted; with seek=True the reader jumps
+    straight to each sampled frame, which pays off when samples are further apart than keyframes.
+    """
     video = cv2.VideoCapture(video_path)
-    frame_count = 0
+    step = sampling_step(video, step, interval_seconds)
+    try:
+        if seek:
+            frame_index = 0
+            while True:
+                video.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                ret, frame = video.read()
+                if not ret:
+                    break
+                yield frame
+                frame_index += step
+        else:
+            frame_count = 0
+            while video.grab():
+                if frame_count % step == 0:
+                    ret, frame = video.retrieve()
+                    if not ret:
+                        break
+                    yield frame
+                frame_count += 1
+    finally:
+        video.release()
+
+# Extract frame hashes from a video
+def extract_frame_hashes(video_path, step=30, interval_seconds=None, seek=False):
+    return [get_frame_hash(frame) for frame in iter_sampled_frames(video_path, step, interval_seconds, seek)]
+
+def iter_frame_hashes(video_path, step=30, interval_seconds=None, seek=False):
+    """
+    Yield frame hashes as frames are decoded; closing the generator stops the decode.
+    """
+    for frame in iter_sampled_frames(video_path, step, interval_seconds, seek):
+        yield get_frame_hash(frame)
+
+def non_empty_videos(offsets):
+    """
+    Positions of the videos that have at least one hash, videos without hashes can never be picked.
+    """
+    offsets = np.asarray(offsets)
+    non_empty = np.flatnonzero(offsets[1:] > offsets[:-1])
+    if len(non_empty) == 0:
+        raise ValueError("The reference index does not contain any frame hashes.")
+    return non_empty
+
+def matching_bits(query_hashes, offsets, hashes, non_empty):
+    """
+    Per non-empty video, the sum over query hashes of the bits matching the closest hash in that video.
+    """
+    distances = hamming.hamming_distances(query_hashes, hashes)
+    # closest stored hash of each video for every query hash, shape (Q, V)
+    min_distances = np.minimum.reduceat(distances, np.asarray(offsets)[non_empty], axis=1)
+    # integer sums keep ties exact, so the ranking matches the per-character comparison
+    return (hamming.HASH_BITS - min_distances.astype(np.int64)).sum(axis=0)
 
+def video_similarities(query_hashes, names, offsets, hashes):
+    """
+    Score every video as the mean over query hashes of the best matching-bit fraction within that video.
+    """
+    if len(query_hashes) == 0:
+        raise ValueError("No frames could be hashed from the query video.")
+
+    non_empty = non_empty_videos(offsets)
+    scores = matching_bits(query_hashes, offsets, hashes, non_empty) / (hamming.HASH_BITS * len(query_hashes))
+    return {names[i]: score for i, score in zip(non_empty, scores)}
+
+def candidate_library(index, candidates):
+    """
+    (names, offsets, hashes) of just the candidate videos, laid out like a whole index.
+    """
+    names = []
+    packed = []
+    for video, _ in candidates:
+        names.append(index.names[video])
+        packed.append(index.hashes[index.offsets[video]:index.offsets[video + 1]])
+    offsets = np.zeros(len(packed) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(h) for h in packed])
+    return names, offsets, np.concatenate(packed)
+
+def candidate_similarities(query_hashes, index, top_k=5, radius=1):
+    """
+    Shortlist top_k videos by multi-index hash votes and score only those exactly.
+    Falls back to the exhaustive scan when no bucket is hit.
+    """
+    candidates = multi_index.get_multi_index(index).vote(query_hashes, radius, top_k)
+    if not candidates:
+        return video_similarities(query_hashes, index.names, index.offsets, index.hashes)
+    return video_similarities(query_hashes, *candidate_library(index, candidates))
+
+def progressive_similarities(query_hashes, index, top_k=None, radius=1, margin=EARLY_EXIT_MARGIN,
+                             min_frames=EARLY_EXIT_MIN_FRAMES):
+    """
+    Score videos from an iterable of query hashes, keeping running per-video sums and stopping
+    as soon as the leader's mean similarity beats the runner-up by `margin`.
+    Scores are over the hashes consumed so far; when the clip never gets that clear, every
+    hash is used and the scores equal video_similarities. With top_k set, the shortlist is
+    voted from the first min_frames hashes.
+    """
+    query_hashes = iter(query_hashes)
+    opening = pack_hashes(list(itertools.islice(query_hashes, max(1, min_frames))))
+    if len(opening) == 0:
+        raise ValueError("No frames could be hashed from the query video.")
+
+    names, offsets, hashes = index.names, index.offsets, index.hashes
+    if top_k:
+        candidates = multi_index.get_multi_index(index).vote(opening, radius, top_k)
+        if candidates:
+            names, offsets, hashes = candidate_library(index, candidates)
+    non_empty = non_empty_videos(offsets)
+
+    totals = matching_bits(opening, offsets, hashes, non_empty)
+    count = len(opening)
     while True:
-        ret, frame = video.read()
-        if not ret:
+        scores = totals / (hamming.HASH_BITS * count)
+        if len(scores) < 2 or np.diff(np.sort(scores)[-2:])[0] >= margin:
+            break
+        query_hash = next(query_hashes, None)
+        if query_hash is None:
             break
+        totals += matching_bits(pack_hashes([query_hash]), offsets, hashes, non_empty)
+        count += 1
 
-        if frame_count % step == 0:
-            frame_hash = get_frame_hash(frame)
-            frame_hashes.append(frame_hash)
+    if hasattr(query_hashes, 'close'):
+        query_hashes.close()  # releases the decoder of a frame hash generator right away
+    return {names[i]: score for i, score in zip(non_empty, scores)}
 
-        frame_count += 1
+def rank_similar_videos(query_video_path, index_path, top_k=None, radius=1, progressive=False, margin=EARLY_EXIT_MARGIN):
+    """
+    Return [(video name, similarity)] for the reference videos, most similar first.
+    With top_k set, only the top_k videos voted by the multi-index hash tables are scored, a vote
+    needs a stored hash within 4 * (radius + 1) - 1 bits of a query hash (7 at radius 1) and clips
+    with no such hash are scored exhaustively; higher radius means better recall but slower lookups.
+    With progressive=True the query is decoded only until one video leads by `margin`,
+    so clear clips are identified from their first few seconds whatever their length.
+    A sharded index scores the whole clip exactly on its shard workers and merges their top_k.
+    """
+    # Load the preprocessed frame hashes, binary indexes are memory-mapped rather than parsed
+    if isinstance(index_path, str):
+        index = reference_index.load_index(index_path)
+    else:
+        index = index_path  # already loaded, e.g. kept warm by a long running process
 
-    video.release()
-    return frame_hashes
+    if not isinstance(index, reference_index.ReferenceIndex):
+        # sharded_index.ShardedIndex, the shard workers do the scoring in parallel
+        return index.rank(pack_hashes(extract_frame_hashes(query_video_path)), top_k)
 
-# Find the most similar video
-def find_similar_video(query_video_path, json_path):
-    # Load the preprocessed frame hashes
-    with open(json_path, 'r') as json_file:
-        video_hashes = json.load(json_file)
+    if progressive:
+        similarities = progressive_similarities(iter_frame_hashes(query_video_path), index, top_k, radius, margin)
+        return sorted(similarities.items(), key=lambda x: -x[1])
 
-    query_frame_hashes = extract_frame_hashes(query_video_path)
-    similarities = {}
+    query_frame_hashes = pack_hashes(extract_frame_hashes(query_video_path))
 
     # Calculate similarities
-    for video_name, frame_hashes in video_hashes.items():
-        frame_similarities = [
-            max(sum(c1 == c2 for c1, c2 in zip(query_hash, video_hash)) / 64
-                for video_hash in frame_hashes)
-            for query_hash in query_frame_hashes
-        ]
-        similarities[video_name] = np.mean(frame_similarities)
+    if top_k:
+        similarities = candidate_similarities(query_frame_hashes, index, top_k, radius)
+    else:
+        similarities = video_similarities(query_frame_hashes, index.names, index.offsets, index.hashes)
 
+    return sorted(similarities.items(), key=lambda x: -x[1])
+
+# Find the most similar video
+def find_similar_video(query_video_path, index_path, top_k=None, radius=1, progressive=False):
     # Return the most similar video
-    return sorted(similarities.items(), key=lambda x: -x[1])[0][0]
+    return rank_similar_videos(query_video_path, index_path, top_k, radius, progressive)[0][0]
 
 # Example usage
 # query_video_path = './Queries/video10_1_modified.mp4'  # Path to the query video
-# json_path = "./preprocessing.json"  # Preprocessing JSON file path
+# index_path = "./preprocessing.idx"  # Binary index (or legacy preprocessing.json) path
 
 # Find the most similar video
-# most_similar_video = find_similar_video(query_video_path, json_path)
-# print("The most similar video is:", most_similar_video)
\ No newline at end of file
+# most_similar_video = find_similar_video(query_video_path, index_path)
+# print("The most similar video is:", most_similar_video)
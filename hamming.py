@@ -0,0 +1,30 @@
+import numpy as np
+
+HASH_BITS = 64
+
+# number of set bits for every possible byte value, used to popcount uint64 arrays
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def popcount64(values):
+    """
+    Count the set bits of every element in a uint64 array.
+    """
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    counts = _POPCOUNT_TABLE[values.view(np.uint8)]
+    return counts.reshape(values.shape + (8,)).sum(axis=-1, dtype=np.uint8)
+
+def hamming_distances(query_hashes, library_hashes, chunk_size=64):
+    """
+    Hamming distance between every query hash and every library hash, as a (Q, N) uint8 matrix.
+    """
+    query_hashes = np.asarray(query_hashes, dtype=np.uint64)
+    library_hashes = np.asarray(library_hashes, dtype=np.uint64)
+    distances = np.empty((len(query_hashes), len(library_hashes)), dtype=np.uint8)
+
+    # chunk over the query so the XOR temporaries stay small for big libraries
+    for start in range(0, len(query_hashes), chunk_size):
+        block = query_hashes[start:start + chunk_size, None] ^ library_hashes[None, :]
+        distances[start:start + chunk_size] = popcount64(block)
+    return distances
@@ -0,0 +1,89 @@
+from collections import namedtuple
+import numpy as np
+import audio_cache
+import audiofingerprint
+import find_similar_video
+import reference_index
+
+# below this RMS (float PCM, full scale 1.0) the query is treated as silent
+SILENCE_RMS = 1e-3
+# the audio winner needs at least this many agreeing landmarks and this ratio over the runner-up
+MIN_VOTES = 20
+MIN_VOTE_RATIO = 2.0
+
+# source is 'audio' for landmark matches and 'visual' for the frame hash fallback
+Match = namedtuple('Match', ['video', 'offset_seconds', 'confidence', 'source'])
+
+def is_silent(samples, threshold=SILENCE_RMS):
+    return len(samples) == 0 or float(np.sqrt(np.mean(np.square(samples, dtype=np.float64)))) < threshold
+
+def is_ambiguous(matches, min_votes=MIN_VOTES, min_ratio=MIN_VOTE_RATIO):
+    """
+    True when the landmark votes do not single out one reference video.
+    """
+    if not matches or matches[0][2] < min_votes:
+        return True
+    return len(matches) > 1 and matches[0][2] < min_ratio * matches[1][2]
+
+def audio_matches(samples, landmark_index, top_k):
+    """
+    Landmark lookup across every reference; confidence is each candidate's share of the top_k votes.
+    Returns (raw (video, offset, votes) matches, Match list).
+    """
+    matches = landmark_index.match(samples, top_k)
+    total_votes = sum(votes for _, _, votes in matches)
+    return matches, [Match(video, offset, votes / total_votes, 'audio') for video, offset, votes in matches]
+
+def visual_matches(query_video_path, samples, index_path, top_k, window, sample_rate, audio_cache_dir):
+    """
+    Rank by frame hashes, then locate each candidate by correlating against its cached audio.
+    Offsets are None when the query is silent or the reference audio was never cached.
+    """
+    # the shortlist is never narrower than the candidates asked for
+    ranked = find_similar_video.rank_similar_videos(query_video_path, index_path, max(top_k, find_similar_video.SHORTLIST_TOP_K),
+                                                    find_similar_video.SHORTLIST_RADIUS, progressive=True)[:top_k]
+    silent = is_silent(samples)
+    matches = []
+    for video, similarity in ranked:
+        offset = None
+        reference_audio = None if silent else audio_cache.load_reference_audio(video, audio_cache_dir, sample_rate)
+        if reference_audio is not None and len(reference_audio) >= len(samples):
+            offset = audiofingerprint.find_audio_offset(np.asarray(reference_audio, dtype=np.float32), samples, sample_rate, window)
+        matches.append(Match(video, offset, float(similarity), 'visual'))
+    return matches
+
+def load_query_audio(query_video_path, sample_rate, window):
+    """
+    The first window seconds of the query's audio, empty when it has no audio stream.
+    """
+    try:
+        return audiofingerprint.load_audio(query_video_path, sample_rate, duration=window)
+    except RuntimeError:
+        # no audio stream at all, as good as silent; a broken file is reported by the frame hash pass
+        return np.empty(0, dtype=np.float32)
+
+def identify_and_locate(query_video_path, landmark_index=None, index_path=None, top_k=5, window=10,
+                        audio_cache_dir=audio_cache.DEFAULT_AUDIO_CACHE_DIR):
+    """
+    Identify the reference video of a query clip and where it starts, best candidate first.
+    The audio landmark index resolves both in one lookup; frame hashes are only used when the
+    query is silent, the landmark votes are ambiguous or no landmark index has been built.
+    """
+    if landmark_index is None:
+        landmark_index = audio_cache.load_landmark_index()
+    sample_rate = landmark_index.sample_rate if landmark_index is not None else audiofingerprint.ANALYSIS_SAMPLE_RATE
+    samples = load_query_audio(query_video_path, sample_rate, window)
+    return identify_samples(query_video_path, samples, landmark_index, index_path, top_k, window, sample_rate, audio_cache_dir)
+
+def identify_samples(query_video_path, samples, landmark_index, index_path, top_k, window, sample_rate, audio_cache_dir):
+    """
+    identify_and_locate on query audio already decoded at sample_rate, so callers can reuse it.
+    """
+    if landmark_index is not None and not is_silent(samples):
+        # the ambiguity test compares the winner with the runner-up, so always fetch both
+        raw_matches, matches = audio_matches(samples, landmark_index, max(top_k, 2))
+        if not is_ambiguous(raw_matches):
+            return matches[:top_k]
+
+    return visual_matches(query_video_path, samples, index_path or reference_index.default_index_path(),
+                          top_k, window, sample_rate, audio_cache_dir)
@@ -0,0 +1,107 @@
+import cProfile
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# set to a directory to get a cProfile dump per GUI match
+PROFILE_DIR_ENV = 'VIDEO_MATCHER_PROFILE_DIR'
+
+class StageRecorder:
+    """
+    Records wall time, CPU time and memory for each named stage of a match.
+
+    thread_cpu_seconds is the calling thread's own CPU time; process_cpu_seconds also counts the
+    native threads NumPy and OpenCV spin up, and any other match running in the same process.
+    rss_delta_bytes is how much the resident set grew (or shrank) over the stage and
+    max_rss_growth_bytes how far the stage pushed the process high-water mark past its earlier
+    peak, both process wide. With trace_memory=True, peak_traced_bytes is the peak Python/NumPy
+    allocation traced by tracemalloc during the stage.
+    With profile_path set the whole request runs under cProfile and is dumped by finish().
+    """
+    def __init__(self, trace_memory=False, profile_path=None):
+        self.stages = {}
+        self.trace_memory = trace_memory
+        self.profile_path = profile_path
+        self.profiler = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextmanager
+    def stage(self, name):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        rss_start = current_rss_bytes()
+        max_rss_start = max_rss_bytes()
+        wall_start = time.perf_counter()
+        thread_cpu_start = time.thread_time()
+        process_cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            rss_end = current_rss_bytes()
+            record = {
+                'wall_seconds': time.perf_counter() - wall_start,
+                'thread_cpu_seconds': time.thread_time() - thread_cpu_start,
+                'process_cpu_seconds': time.process_time() - process_cpu_start,
+                'rss_delta_bytes': rss_end - rss_start if rss_start is not None and rss_end is not None else None,
+                'max_rss_growth_bytes': max_rss_bytes() - max_rss_start,
+            }
+            if self.trace_memory:
+                record['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+            self.stages[name] = record
+
+    def timings(self):
+        """
+        Wall seconds per stage.
+        """
+        return {name: record['wall_seconds'] for name, record in self.stages.items()}
+
+    def finish(self):
+        """
+        Stop profiling and write the cProfile dump, returns the stage records.
+        """
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(os.path.dirname(os.path.abspath(self.profile_path)), exist_ok=True)
+            self.profiler.dump_stats(self.profile_path)
+            self.profiler = None
+        return self.stages
+
+def max_rss_bytes():
+    """
+    Lifetime high-water mark of the process resident set.
+    """
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if os.uname().sysname == 'Darwin' else rss * 1024
+
+def current_rss_bytes():
+    """
+    Resident set size right now, None where /proc is not available (macOS).
+    """
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return None
+
+def stage(recorder, name):
+    """
+    recorder.stage(name), or a no-op when no recorder is passed.
+    """
+    return recorder.stage(name) if recorder is not None else nullcontext()
+
+def profile_path(profile_dir, query_video_path):
+    """
+    Dump location for one request, unique per query, start time and worker.
+    """
+    if not profile_dir:
+        return None
+    base_name = os.path.splitext(os.path.basename(query_video_path))[0]
+    return os.path.join(profile_dir, f"{base_name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}.prof")
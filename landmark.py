@@ -0,0 +1,190 @@
+import json
+import os
+import numpy as np
+from scipy.ndimage import maximum_filter
+
+# spectrogram geometry at the audio analysis rate, one frame is HOP / sample_rate seconds (32 ms at 8 kHz)
+N_FFT = 1024
+HOP = 256
+FREQ_BITS = 9  # bins above 2 ** FREQ_BITS are dropped, 512 bins cover 0-4 kHz at 8 kHz
+DT_BITS = 6
+
+# peak picking and pairing
+PEAK_NEIGHBOURHOOD = (15, 11)  # (frequency bins, time frames)
+PEAK_THRESHOLD_DB = 10.0  # above the spectrogram median
+MAX_PEAKS_PER_SECOND = 30
+FAN_OUT = 5
+MAX_PAIR_DT = (1 << DT_BITS) - 1
+
+def spectrogram_db(samples):
+    """
+    Log-magnitude STFT of mono samples, shape (frequency bins, frames).
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if len(samples) < N_FFT:
+        return np.empty((N_FFT // 2 + 1, 0), dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, N_FFT)[::HOP]
+    magnitude = np.abs(np.fft.rfft(frames * np.hanning(N_FFT).astype(np.float32), axis=1))
+    return (20 * np.log10(magnitude + 1e-6)).T.astype(np.float32)
+
+def find_peaks(spectrogram, sample_rate):
+    """
+    Local spectrogram maxima as (frames, bins) arrays sorted by time, strongest first within the density cap.
+    """
+    spectrogram = spectrogram[:1 << FREQ_BITS]
+    if spectrogram.shape[1] == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+    local_max = maximum_filter(spectrogram, size=PEAK_NEIGHBOURHOOD, mode='constant', cval=-np.inf) == spectrogram
+    floor = np.median(spectrogram) + PEAK_THRESHOLD_DB
+    bins, frames = np.nonzero(local_max & (spectrogram > floor))
+
+    # cap the density so loud passages do not flood the index
+    max_peaks = int(MAX_PEAKS_PER_SECOND * spectrogram.shape[1] * HOP / sample_rate) + 1
+    if len(frames) > max_peaks:
+        strongest = np.argsort(-spectrogram[bins, frames], kind='stable')[:max_peaks]
+        bins, frames = bins[strongest], frames[strongest]
+
+    order = np.lexsort((bins, frames))
+    return frames[order].astype(np.int32), bins[order].astype(np.int32)
+
+def peak_pair_hashes(frames, bins):
+    """
+    Pair every anchor peak with up to FAN_OUT later peaks and hash (f1, f2, dt).
+    Returns (hashes uint32, anchor frames int32).
+    """
+    hashes = []
+    anchors = []
+    taken = np.zeros(len(frames), dtype=np.int32)
+    # peaks are time sorted, so scanning a few positions ahead finds the nearest targets
+    for step in range(1, FAN_OUT * 3 + 1):
+        anchor = np.arange(len(frames) - step)
+        target = anchor + step
+        dt = frames[target] - frames[anchor]
+        valid = (dt > 0) & (dt <= MAX_PAIR_DT) & (taken[anchor] < FAN_OUT)
+        anchor, target, dt = anchor[valid], target[valid], dt[valid]
+        taken[anchor] += 1
+        hashes.append((bins[anchor].astype(np.uint32) << (FREQ_BITS + DT_BITS))
+                      | (bins[target].astype(np.uint32) << DT_BITS) | dt.astype(np.uint32))
+        anchors.append(frames[anchor])
+    if not hashes:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int32)
+    return np.concatenate(hashes), np.concatenate(anchors).astype(np.int32)
+
+def fingerprint(samples, sample_rate):
+    """
+    Landmark hashes and their anchor frames for mono samples at the analysis rate.
+    """
+    frames, bins = find_peaks(spectrogram_db(samples), sample_rate)
+    return peak_pair_hashes(frames, bins)
+
+def vote_offsets(query_hashes, query_frames, hashes, videos, frames, video_count):
+    """
+    Look every query hash up in a hash-sorted table and vote on (video, frame delta).
+    Returns (videos, deltas, votes) sorted by votes, best first.
+    """
+    begin = np.searchsorted(hashes, query_hashes, side='left')
+    lengths = np.searchsorted(hashes, query_hashes, side='right') - begin
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    run_starts = np.cumsum(lengths) - lengths
+    positions = np.repeat(begin - run_starts, lengths) + np.arange(total)
+    deltas = frames[positions].astype(np.int64) - np.repeat(query_frames, lengths)
+    keys = videos[positions].astype(np.int64)
+
+    # pack (video, delta) into one key so np.unique can count the votes
+    delta_base = int(deltas.min())
+    span = int(deltas.max()) - delta_base + 1
+    packed, votes = np.unique(keys * span + (deltas - delta_base), return_counts=True)
+    order = np.argsort(-votes, kind='stable')
+    packed, votes = packed[order], votes[order]
+    return packed // span, packed % span + delta_base, votes
+
+def find_landmark_offset(y_within, y_find, sample_rate, window):
+    """
+    Offset in seconds of the first `window` seconds of y_find within y_within by landmark voting.
+    """
+    y_find = y_find[:sample_rate * window]
+    within_hashes, within_frames = fingerprint(y_within, sample_rate)
+    find_hashes, find_frames = fingerprint(y_find, sample_rate)
+    if len(within_hashes) == 0 or len(find_hashes) == 0:
+        raise ValueError("Not enough audio landmarks to locate the query.")
+
+    order = np.argsort(within_hashes, kind='stable')
+    _, deltas, _ = vote_offsets(find_hashes, find_frames, within_hashes[order],
+                                np.zeros(len(order), dtype=np.int32), within_frames[order], 1)
+    if len(deltas) == 0:
+        raise ValueError("No audio landmarks of the query were found in the reference.")
+    return round(max(int(deltas[0]), 0) * HOP / sample_rate, 2)
+
+class LandmarkIndex:
+    """
+    Inverted hash -> (video, frame) index over the landmarks of every reference video.
+    """
+    def __init__(self, names, hashes, videos, frames, sample_rate):
+        self.names = names
+        self.hashes = hashes
+        self.videos = videos
+        self.frames = frames
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def build(cls, fingerprints, sample_rate):
+        """
+        Build from {video name: (hashes, frames)}.
+        """
+        names = list(fingerprints)
+        hashes = np.concatenate([fingerprints[name][0] for name in names]) if names else np.empty(0, dtype=np.uint32)
+        frames = np.concatenate([fingerprints[name][1] for name in names]) if names else np.empty(0, dtype=np.int32)
+        videos = np.repeat(np.arange(len(names), dtype=np.int32), [len(fingerprints[name][0]) for name in names])
+        order = np.argsort(hashes, kind='stable')
+        return cls(names, hashes[order], videos[order], frames[order], sample_rate)
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        # names.json is the commit marker, drop it first so a crash below never pairs it with a mix of old and new arrays
+        names_path = os.path.join(index_dir, 'names.json')
+        if os.path.exists(names_path):
+            os.remove(names_path)
+        for field in ('hashes', 'videos', 'frames'):
+            # replaced rather than rewritten in place, so a reader still mapping the old file keeps its pages
+            path = os.path.join(index_dir, f"{field}.npy")
+            tmp_path = f"{path}.tmp{os.getpid()}"
+            with open(tmp_path, 'wb') as array_file:
+                np.save(array_file, getattr(self, field))
+            os.replace(tmp_path, path)
+        # names.json is written last and atomically, loaders treat it as the commit marker
+        tmp_path = os.path.join(index_dir, f"names.json.tmp{os.getpid()}")
+        with open(tmp_path, 'w') as names_file:
+            json.dump({'names': self.names, 'sample_rate': self.sample_rate}, names_file)
+        os.replace(tmp_path, names_path)
+
+    @classmethod
+    def load(cls, index_dir):
+        """
+        Memory-map a saved index.
+        """
+        with open(os.path.join(index_dir, 'names.json'), 'r') as names_file:
+            meta = json.load(names_file)
+        arrays = [np.load(os.path.join(index_dir, f"{field}.npy"), mmap_mode='r') for field in ('hashes', 'videos', 'frames')]
+        return cls(meta['names'], *arrays, sample_rate=meta['sample_rate'])
+
+    def match(self, samples, top_k=5):
+        """
+        Return up to top_k (video name, offset seconds, votes) for query samples, best first,
+        keeping only the best offset of each video.
+        """
+        query_hashes, query_frames = fingerprint(samples, self.sample_rate)
+        videos, deltas, votes = vote_offsets(query_hashes, query_frames, self.hashes, self.videos, self.frames, len(self.names))
+        matches = []
+        seen = set()
+        for video, delta, count in zip(videos, deltas, votes):
+            if video in seen:
+                continue
+            seen.add(video)
+            matches.append((self.names[video], round(max(int(delta), 0) * HOP / self.sample_rate, 2), int(count)))
+            if len(matches) == top_k:
+                break
+        return matches
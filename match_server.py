@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import audio_cache
+import batch_match
+import reference_index
+import result_cache
+import thumbnail_store
+
+MAX_BODY_BYTES = 64 * 1024
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+class MatchServer:
+    """
+    Long running matcher: the reference data is loaded once and requests are served from a
+    bounded queue. When the queue is full new requests get 503 instead of piling up.
+    """
+    def __init__(self, executor, workers, queue_size):
+        self.executor = executor
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.active = 0
+        self.served = 0
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self.consume()) for _ in range(self.workers)]
+
+    async def consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            query_video_path, future = await self.queue.get()
+            self.active += 1
+            try:
+                result = await loop.run_in_executor(self.executor, batch_match.run_query, query_video_path)
+                if not future.cancelled():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self.active -= 1
+                self.served += 1
+                self.queue.task_done()
+
+    async def match(self, query_video_path):
+        """
+        Queue one match and wait for it, or return None straight away when the queue is full.
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((query_video_path, future))
+        except asyncio.QueueFull:
+            return None
+        return await future
+
+    async def handle(self, reader, writer):
+        try:
+            status, body = await self.route(reader)
+        except Exception as e:
+            status, body = 500, {'error': f"{type(e).__name__}: {e}"}
+        payload = json.dumps(body).encode('utf-8')
+        headers = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}", 'Content-Type: application/json',
+                   f"Content-Length: {len(payload)}", 'Connection: close']
+        if status == 503:
+            headers.append('Retry-After: 1')
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode('latin-1') + payload)
+        await writer.drain()
+        writer.close()
+
+    async def route(self, reader):
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        if not request_line:
+            return 400, {'error': 'empty request'}
+        parts = request_line.split(' ')
+        if len(parts) != 3:
+            return 400, {'error': 'malformed request line'}
+        method, path, _ = parts
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if path == '/health':
+            return 200, {'status': 'ok', 'queued': self.queue.qsize(), 'active': self.active, 'served': self.served}
+        if path != '/match':
+            return 404, {'error': f"unknown path {path}"}
+        if method != 'POST':
+            return 405, {'error': 'use POST /match'}
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            return 400, {'error': 'invalid Content-Length'}
+        if length < 0:
+            return 400, {'error': 'invalid Content-Length'}
+        if length > MAX_BODY_BYTES:
+            return 413, {'error': 'request body too large'}
+        try:
+            request = json.loads(await reader.readexactly(length))
+            query_video_path = request['path']
+            if not isinstance(query_video_path, str):
+                raise TypeError(query_video_path)
+        except (ValueError, KeyError, TypeError, asyncio.IncompleteReadError):
+            return 400, {'error': 'expected a JSON body like {"path": "/path/to/query.mp4"}'}
+        # the server's working directory means nothing to the client, and a bad path is the
+        # client's mistake, so check it here rather than let the pipeline fail with a 500
+        if not os.path.isabs(query_video_path):
+            return 400, {'error': f"path must be absolute: {query_video_path}"}
+        if not os.path.isfile(query_video_path):
+            return 404, {'error': f"no such file: {query_video_path}"}
+        if not os.access(query_video_path, os.R_OK):
+            return 400, {'error': f"file is not readable: {query_video_path}"}
+
+        result = await self.match(query_video_path)
+        if result is None:
+            return 503, {'error': 'match queue is full, retry later'}
+        return (200 if result['status'] == 'ok' else 500), result
+
+async def serve(host, port, executor, workers, queue_size):
+    server = MatchServer(executor, workers, queue_size)
+    await server.start()
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"Matching service listening on http://{host}:{port} (POST /match, GET /health).")
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve video matches over local HTTP with the reference index kept warm.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2, help="matches run concurrently (default: 2)")
+    parser.add_argument('--queue-size', type=int, default=16, help="requests waiting beyond the running ones before 503 (default: 16)")
+    parser.add_argument('--processes', action='store_true', help="run matches in worker processes instead of threads")
+    parser.add_argument('--index', default=None, help="reference index (default: preprocessing.idx, else preprocessing.json)")
+    parser.add_argument('--landmarks', default=audio_cache.DEFAULT_LANDMARK_INDEX_DIR, help="audio landmark index directory")
+    parser.add_argument('--video-dir', default='./video', help="directory of reference videos (default: ./video)")
+    parser.add_argument('--audio-cache', default=audio_cache.DEFAULT_AUDIO_CACHE_DIR, help="reference audio cache directory")
+    parser.add_argument('--profile-dir', default=None, help="write a cProfile dump per request into this directory")
+    parser.add_argument('--trace-memory', action='store_true', help="record peak traced allocations per stage (slower)")
+    parser.add_argument('--thumbnails', default=thumbnail_store.DEFAULT_THUMBNAIL_DIR, help="reference thumbnail store directory")
+    parser.add_argument('--result-cache', default=result_cache.DEFAULT_RESULT_CACHE_DIR, help="directory of cached match results")
+    parser.add_argument('--no-result-cache', action='store_true', help="always rerun the full pipeline")
+    args = parser.parse_args()
+
+    initargs = (args.index or reference_index.default_index_path(), args.landmarks, args.video_dir, args.audio_cache,
+                args.profile_dir, args.trace_memory, None if args.no_result_cache else args.result_cache, args.thumbnails)
+    if args.processes:
+        executor = ProcessPoolExecutor(max_workers=args.workers, initializer=batch_match.init_worker, initargs=initargs)
+    else:
+        # load once in this process, the worker threads share the mapped indexes
+        batch_match.init_worker(*initargs)
+        executor = ThreadPoolExecutor(max_workers=args.workers)
+
+    try:
+        asyncio.run(serve(args.host, args.port, executor, args.workers, args.queue_size))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import itertools
+import os
+import numpy as np
+import hamming
+
+# cache of built tables keyed by index path, invalidated when the index file changes
+_cache = {}
+
+def probe_masks(block_bits, radius):
+    """
+    All XOR masks of at most `radius` set bits within one block, the zero mask first.
+    """
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in itertools.combinations(range(block_bits), r):
+            masks.append(sum(1 << b for b in bits))
+    return np.array(masks, dtype=np.int64)
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over 64-bit frame hashes.
+
+    Every hash is split into `blocks` sub-blocks and each sub-block gets its own bucket table.
+    By the pigeonhole principle, two hashes within Hamming distance blocks * (radius + 1) - 1
+    share at least one sub-block within distance `radius`, so probing every sub-block with all
+    masks of up to `radius` bits finds them. Raising the radius raises recall and probe cost.
+    """
+    def __init__(self, offsets, hashes, blocks=4):
+        if blocks not in (4, 8):
+            raise ValueError("blocks must be 4 (16-bit sub-blocks) or 8 (8-bit sub-blocks).")
+        self.blocks = blocks
+        self.block_bits = hamming.HASH_BITS // blocks
+        self.video_count = len(offsets) - 1
+
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        self.hashes = hashes  # bucket hits are checked against the full hashes before they count
+        # owning video of every stored hash
+        self.row_video = np.repeat(np.arange(self.video_count, dtype=np.int32), np.diff(offsets))
+
+        self.orders = []
+        self.starts = []
+        for values in self._split(hashes):
+            # radix sort on the small block values, buckets are contiguous runs of the order array
+            self.orders.append(np.argsort(values, kind='stable').astype(np.int64))
+            counts = np.bincount(values, minlength=1 << self.block_bits)
+            starts = np.zeros(len(counts) + 1, dtype=np.int64)
+            np.cumsum(counts, out=starts[1:])
+            self.starts.append(starts)
+
+    def _split(self, hashes):
+        mask = np.uint64((1 << self.block_bits) - 1)
+        for b in range(self.blocks):
+            yield ((hashes >> np.uint64(b * self.block_bits)) & mask).astype(np.int64)
+
+    def candidates(self, query_hashes, radius=1):
+        """
+        Return (query positions, stored rows) for every bucket hit, duplicates included.
+        """
+        query_hashes = np.asarray(query_hashes, dtype=np.uint64)
+        masks = probe_masks(self.block_bits, radius)
+        query_positions = []
+        rows = []
+
+        for values, order, starts in zip(self._split(query_hashes), self.orders, self.starts):
+            keys = (values[:, None] ^ masks[None, :]).ravel()
+            begin = starts[keys]
+            lengths = starts[keys + 1] - begin
+            total = int(lengths.sum())
+            if total == 0:
+                continue
+            # expand every [begin, begin + length) bucket range without a Python loop
+            run_starts = np.cumsum(lengths) - lengths
+            positions = np.repeat(begin - run_starts, lengths) + np.arange(total)
+            rows.append(order[positions])
+            query_positions.append(np.repeat(np.arange(len(keys)) // len(masks), lengths))
+
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(query_positions), np.concatenate(rows)
+
+    def search_radius(self, radius=1):
+        """
+        Full 64-bit Hamming distance the sub-block probes of the given radius are guaranteed to cover.
+        """
+        return self.blocks * (radius + 1) - 1
+
+    def vote(self, query_hashes, radius=1, top_k=5):
+        """
+        Rank videos by their stored hashes that really lie within the search radius of a query hash.
+        A single sub-block hit says little about the whole hash (low-entropy frame hashes share
+        sub-blocks with half the library), so every hit is checked at full 64-bit distance and each
+        (query hash, video) pair votes once, weighted by how close its nearest hash is.
+        Returns up to top_k (video position, votes) pairs, best first.
+        """
+        query_hashes = np.asarray(query_hashes, dtype=np.uint64)
+        query_positions, rows = self.candidates(query_hashes, radius)
+        if len(rows) == 0:
+            return []
+
+        search_radius = self.search_radius(radius)
+        distances = hamming.popcount64(query_hashes[query_positions] ^ self.hashes[rows]).astype(np.int64)
+        within = distances <= search_radius
+        if not within.any():
+            return []
+        pairs = query_positions[within] * self.video_count + self.row_video[rows[within]]
+        closeness = search_radius + 1 - distances[within]
+
+        # nearest hit per (query hash, video) pair: sort by pair then closeness, keep each pair's last entry
+        order = np.lexsort((closeness, pairs))
+        pairs, closeness = pairs[order], closeness[order]
+        last = np.append(pairs[1:] != pairs[:-1], True)
+        votes = np.bincount(pairs[last] % self.video_count, weights=closeness[last], minlength=self.video_count)
+        ranked = np.argsort(-votes, kind='stable')[:top_k]
+        return [(int(v), int(votes[v])) for v in ranked if votes[v] > 0]
+
+def get_multi_index(index, blocks=4):
+    """
+    Build, or reuse, the multi-index tables for a loaded reference index.
+    """
+    key = (index.path, blocks)
+    version = os.path.getmtime(index.path) if index.path and os.path.exists(index.path) else None
+    cached = _cache.get(key)
+    if cached is None or cached[0] != version or index.path is None:
+        cached = (version, MultiIndexHash(index.offsets, index.hashes, blocks))
+        if index.path is not None:
+            _cache[key] = cached
+    return cached[1]
@@ -0,0 +1,130 @@
+import os
+import audio_cache
+import audiofingerprint
+import find_frame
+import find_similar_video
+import identify
+import instrumentation
+import reference_index
+import result_cache
+import thumbnail_store
+
+# seconds of query audio used to locate the clip, as in the GUI
+OFFSET_WINDOW = 10
+
+class MatchContext:
+    """
+    Read-only reference data shared by every match: the frame hash index, the optional audio
+    landmark index, where reference videos, their cached audio and their thumbnails live and the
+    optional result cache.
+    """
+    def __init__(self, index, landmark_index=None, video_dir='./video', audio_cache_dir=audio_cache.DEFAULT_AUDIO_CACHE_DIR,
+                 result_cache=None, thumbnail_dir=thumbnail_store.DEFAULT_THUMBNAIL_DIR):
+        self.index = index
+        self.landmark_index = landmark_index
+        self.video_dir = os.path.abspath(video_dir)
+        self.audio_cache_dir = audio_cache_dir
+        self.result_cache = result_cache
+        self.thumbnail_dir = thumbnail_dir
+
+    @classmethod
+    def load(cls, index_path=None, landmark_index_dir=audio_cache.DEFAULT_LANDMARK_INDEX_DIR, video_dir='./video',
+             audio_cache_dir=audio_cache.DEFAULT_AUDIO_CACHE_DIR, result_cache_dir=None,
+             thumbnail_dir=thumbnail_store.DEFAULT_THUMBNAIL_DIR):
+        """
+        Memory-map the indexes once; forked or spawned workers each map the same pages read-only.
+        Results are cached only when result_cache_dir is given.
+        """
+        index = reference_index.load_index(index_path or reference_index.default_index_path())
+        landmark_index = audio_cache.load_landmark_index(landmark_index_dir) if landmark_index_dir else None
+        cache = result_cache.open_result_cache(result_cache_dir, index, landmark_index) if result_cache_dir else None
+        return cls(index, landmark_index, video_dir, audio_cache_dir, cache, thumbnail_dir)
+
+    def video_path(self, video_name):
+        return os.path.join(self.video_dir, video_name)
+
+def identify_query(query_video_path, context):
+    """
+    Identify the reference video the query was cut from, audio landmarks first when indexed.
+    Returns (video name, landmark offset seconds or None, query audio or None); the audio is only
+    returned when it was decoded at the analysis rate, so locate_query can reuse it.
+    """
+    if context.landmark_index is not None:
+        sample_rate = context.landmark_index.sample_rate
+        samples = identify.load_query_audio(query_video_path, sample_rate, OFFSET_WINDOW)
+        matches = identify.identify_samples(query_video_path, samples, context.landmark_index, context.index, 1,
+                                            OFFSET_WINDOW, sample_rate, context.audio_cache_dir)
+        reusable = sample_rate == audiofingerprint.ANALYSIS_SAMPLE_RATE and len(samples) > 0
+        return matches[0].video, matches[0].offset_seconds, samples if reusable else None
+    video_name = find_similar_video.find_similar_video(query_video_path, context.index, find_similar_video.SHORTLIST_TOP_K,
+                                                       find_similar_video.SHORTLIST_RADIUS, progressive=True)
+    return video_name, None, None
+
+def locate_query(query_video_path, video_name, context, recorder=None, query_audio=None, near=None):
+    """
+    (offset seconds, offset confidence) of the query's audio within the reference video.
+    query_audio and near, as returned by identify_query, skip decoding the query again and seed
+    the search with the landmark offset.
+    """
+    with instrumentation.stage(recorder, 'audio_decode'):
+        reference_audio = audio_cache.load_reference_audio(video_name, context.audio_cache_dir)
+        y_within, y_find = audiofingerprint.load_video_pair_audio(context.video_path(video_name), query_video_path, OFFSET_WINDOW,
+                                                                  audiofingerprint.ANALYSIS_SAMPLE_RATE, reference_audio, query_audio)
+    with instrumentation.stage(recorder, 'audio_offset'):
+        return audiofingerprint.locate_audio(y_within, y_find, audiofingerprint.ANALYSIS_SAMPLE_RATE, OFFSET_WINDOW, near=near)
+
+def align_query(query_video_path, video_name, offset_seconds, context, recorder=None):
+    """
+    Frame index of the query start in the reference video, read from its stored thumbnails when built.
+    """
+    thumbnails = thumbnail_store.load_thumbnails(video_name, context.thumbnail_dir) if context.thumbnail_dir else None
+    return find_frame.process_videos(context.video_path(video_name), query_video_path, offset_seconds,
+                                     recorder=recorder, thumbnails=thumbnails)
+
+def cached_match(query_video_path, context, recorder=None):
+    """
+    (query digest, stored match or None) when the context has a result cache, else (None, None).
+    """
+    if context.result_cache is None or not os.path.exists(query_video_path):
+        # a missing query is reported by the stage that reads it
+        return None, None
+    with instrumentation.stage(recorder, 'cache_lookup'):
+        digest = result_cache.query_digest(query_video_path)
+        return digest, context.result_cache.get(digest)
+
+def store_match(digest, context, video_name, offset_seconds, frame_index, confidence):
+    if digest is None:
+        return
+    context.result_cache.put(digest, {'video': video_name, 'offset_seconds': float(offset_seconds),
+                                      'frame_index': int(frame_index), 'confidence': float(confidence)})
+
+def match_query(query_video_path, context, recorder=None):
+    """
+    Run identification, audio offset and frame alignment for one query clip.
+    Returns the (video, offset_seconds, frame_index) the GUI shows plus the offset confidence,
+    whether it came from the result cache, wall time per stage and, when a StageRecorder is
+    passed, its full per-stage records.
+    """
+    recorder = recorder or instrumentation.StageRecorder()
+
+    digest, cached = cached_match(query_video_path, context, recorder)
+    if cached is not None:
+        return dict(cached, cached=True, timings=recorder.timings(), stages=recorder.finish())
+
+    with recorder.stage('identify'):
+        video_name, landmark_offset, query_audio = identify_query(query_video_path, context)
+
+    offset_seconds, confidence = locate_query(query_video_path, video_name, context, recorder, query_audio, landmark_offset)
+
+    frame_index = align_query(query_video_path, video_name, offset_seconds, context, recorder)
+    store_match(digest, context, video_name, offset_seconds, frame_index, confidence)
+
+    return {
+        'video': video_name,
+        'offset_seconds': float(offset_seconds),
+        'frame_index': int(frame_index),
+        'confidence': float(confidence),
+        'cached': False,
+        'timings': recorder.timings(),
+        'stages': recorder.finish(),
+    }
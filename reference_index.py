@@ -0,0 +1,157 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import numpy as np
+import find_similar_video
+
+# binary layout (little endian):
+#   header   magic, version, video count, hash count, metadata length
+#   metadata UTF-8 JSON {"videos": [{"name": ...}, ...]}, zero padded to 8 bytes
+#   offsets  int64[video count + 1], hashes of video i are hashes[offsets[i]:offsets[i + 1]]
+#   hashes   uint64[hash count]
+INDEX_MAGIC = b'VMINDEX\x00'
+INDEX_VERSION = 1
+_HEADER = struct.Struct('<8sIIQQ')
+
+DEFAULT_JSON_PATH = './preprocessing.json'
+DEFAULT_INDEX_PATH = './preprocessing.idx'
+
+class ReferenceIndex:
+    """
+    Packed frame hashes of the reference library, optionally backed by a memory-mapped file.
+    """
+    def __init__(self, videos, offsets, hashes, path=None, buffer=None):
+        self.videos = videos
+        self.names = [video['name'] for video in videos]
+        self.offsets = offsets
+        self.hashes = hashes
+        self.path = path
+        self._buffer = buffer
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def hash_count(self):
+        return len(self.hashes)
+
+    def hashes_for(self, video_name):
+        """
+        Return the packed hashes of a single reference video.
+        """
+        i = self.names.index(video_name)
+        return self.hashes[self.offsets[i]:self.offsets[i + 1]]
+
+    def close(self):
+        # arrays must be released before the mapping can be closed
+        self.offsets = None
+        self.hashes = None
+        if self._buffer is not None:
+            try:
+                self._buffer.close()
+            except BufferError:
+                # views handed out by hashes_for are still alive, the mapping closes once they are collected
+                pass
+            self._buffer = None
+
+def _padding(length):
+    return -length % 8
+
+def write_index(index_path, entries):
+    """
+    Write (metadata dict, hashes) entries to a binary index file, replacing it atomically.
+    Every metadata dict needs at least a 'name' key.
+    """
+    videos = [dict(meta) for meta, _ in entries]
+    packed = [find_similar_video.pack_hashes(hashes) if not isinstance(hashes, np.ndarray) else hashes.astype(np.uint64, copy=False)
+              for _, hashes in entries]
+
+    offsets = np.zeros(len(packed) + 1, dtype='<i8')
+    offsets[1:] = np.cumsum([len(h) for h in packed])
+    hashes = np.concatenate(packed).astype('<u8', copy=False) if packed else np.empty(0, dtype='<u8')
+    metadata = json.dumps({'videos': videos}).encode('utf-8')
+
+    # write next to the destination and rename so readers never see a half written index
+    tmp_path = f"{index_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as index_file:
+        index_file.write(_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(videos), len(hashes), len(metadata)))
+        index_file.write(metadata + b'\x00' * _padding(_HEADER.size + len(metadata)))
+        index_file.write(offsets.tobytes())
+        index_file.write(hashes.tobytes())
+        index_file.flush()
+        os.fsync(index_file.fileno())
+    os.replace(tmp_path, index_path)
+
+def open_index(index_path):
+    """
+    Memory-map a binary index; offsets and hashes are read-only views into the file.
+    """
+    with open(index_path, 'rb') as index_file:
+        buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, video_count, hash_count, metadata_length = _HEADER.unpack_from(buffer, 0)
+    if magic != INDEX_MAGIC:
+        buffer.close()
+        raise ValueError(f"{index_path} is not a reference index file.")
+    if version != INDEX_VERSION:
+        buffer.close()
+        raise ValueError(f"Unsupported reference index version {version} in {index_path}.")
+
+    position = _HEADER.size
+    metadata = json.loads(buffer[position:position + metadata_length].decode('utf-8'))
+    position += metadata_length + _padding(position + metadata_length)
+
+    offsets = np.frombuffer(buffer, dtype='<i8', count=video_count + 1, offset=position)
+    position += offsets.nbytes
+    hashes = np.frombuffer(buffer, dtype='<u8', count=hash_count, offset=position)
+    return ReferenceIndex(metadata['videos'], offsets, hashes, path=index_path, buffer=buffer)
+
+def read_json_index(json_path):
+    """
+    Load a legacy preprocessing.json file into an in-memory index.
+    """
+    with open(json_path, 'r') as json_file:
+        video_hashes = json.load(json_file)
+
+    entries = [({'name': name}, find_similar_video.pack_hashes(hashes)) for name, hashes in video_hashes.items()]
+    offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(h) for _, h in entries])
+    hashes = np.concatenate([h for _, h in entries]) if entries else np.empty(0, dtype=np.uint64)
+    return ReferenceIndex([meta for meta, _ in entries], offsets, hashes, path=json_path)
+
+def load_index(index_path):
+    """
+    Load a reference index, accepting the binary format, legacy JSON and shard manifests.
+    """
+    if index_path.endswith('.shards'):
+        import sharded_index  # imports this module, so only on demand
+        return sharded_index.open_sharded_index(index_path)
+    if index_path.endswith('.json'):
+        return read_json_index(index_path)
+    return open_index(index_path)
+
+def default_index_path():
+    """
+    Prefer the binary index and fall back to preprocessing.json for unconverted deployments.
+    """
+    if os.path.exists(DEFAULT_INDEX_PATH):
+        return DEFAULT_INDEX_PATH
+    return DEFAULT_JSON_PATH
+
+def convert_json_index(json_path, index_path):
+    """
+    One-shot conversion of preprocessing.json into the binary index format.
+    """
+    index = read_json_index(json_path)
+    entries = [(video, index.hashes[index.offsets[i]:index.offsets[i + 1]]) for i, video in enumerate(index.videos)]
+    write_index(index_path, entries)
+    return index_path
+
+if __name__ == '__main__':
+    # usage: python reference_index.py [preprocessing.json] [preprocessing.idx]
+    json_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_JSON_PATH
+    index_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_PATH
+    convert_json_index(json_path, index_path)
+    print(f"Converted {json_path} to {index_path}.")
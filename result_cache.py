@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+
+DEFAULT_RESULT_CACHE_DIR = './result_cache'
+DEFAULT_MAX_ENTRIES = 1000
+# eviction trims this share of max_entries below the limit, so it runs once per that many new entries
+_EVICT_HEADROOM = 0.1
+
+# bump when a pipeline change alters results for the same query and index
+RESULT_CACHE_VERSION = 1
+
+# files up to this size are hashed whole, larger ones by evenly spaced chunks
+_FULL_DIGEST_LIMIT = 8 * 1024 * 1024
+_DIGEST_CHUNKS = 16
+_DIGEST_CHUNK_SIZE = 64 * 1024
+
+def query_digest(query_video_path):
+    """
+    Fast content digest of a query file: its size plus the whole file when small, otherwise
+    chunks spread across it, so resubmitting a multi-gigabyte clip costs about a megabyte of reads.
+    """
+    size = os.path.getsize(query_video_path)
+    digest = hashlib.blake2b(str(size).encode('ascii'), digest_size=16)
+    with open(query_video_path, 'rb') as query_file:
+        if size <= _FULL_DIGEST_LIMIT:
+            digest.update(query_file.read())
+        else:
+            step = (size - _DIGEST_CHUNK_SIZE) // (_DIGEST_CHUNKS - 1)
+            for i in range(_DIGEST_CHUNKS):
+                query_file.seek(i * step)
+                digest.update(query_file.read(_DIGEST_CHUNK_SIZE))
+    return digest.hexdigest()
+
+def index_version(index, landmark_index=None):
+    """
+    Digest of what the reference indexes contain. The frame index metadata carries every reference
+    video's name and file signature, so a rebuild that changes the library changes the version.
+    """
+    digest = hashlib.blake2b(f"v{RESULT_CACHE_VERSION}".encode('ascii'), digest_size=16)
+    digest.update(json.dumps(index.videos, sort_keys=True).encode('utf-8'))
+    digest.update(str(index.hash_count).encode('ascii'))
+    if landmark_index is not None:
+        digest.update(json.dumps({'names': landmark_index.names, 'sample_rate': landmark_index.sample_rate,
+                                  'hashes': len(landmark_index.hashes)}).encode('utf-8'))
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Persistent match results keyed by query digest and index version, one small JSON file each.
+    Reads touch the file so its mtime orders entries for least recently used eviction.
+    Entries are counted as they are added and the directory is only scanned once the count passes
+    max_entries; other processes sharing the directory are picked up by that scan.
+    """
+    def __init__(self, cache_dir, version, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_entries = max_entries
+        self.entry_count = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.{self.version}.json")
+
+    def get(self, digest):
+        """
+        Stored result for a query digest under the current index version, or None.
+        """
+        path = self.entry_path(digest)
+        try:
+            with open(path, 'r') as entry_file:
+                result = json.load(entry_file)
+            os.utime(path)
+        except (OSError, ValueError):
+            # missing, evicted by another process meanwhile or half written by a crashed one
+            return None
+        return result
+
+    def put(self, digest, result):
+        path = self.entry_path(digest)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        is_new = not os.path.exists(path)
+        with open(tmp_path, 'w') as entry_file:
+            json.dump(result, entry_file)
+        os.replace(tmp_path, path)
+        self.entry_count += is_new
+        if self.entry_count > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop entries of older index versions, then the least recently used ones until max_entries
+        less the eviction headroom remain.
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, file_name)
+            if not file_name.endswith('.json'):
+                continue
+            if not file_name.endswith(f".{self.version}.json"):
+                self._remove(path)
+                continue
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort()
+        keep = len(entries)
+        if keep > self.max_entries:
+            keep = self.max_entries - int(self.max_entries * _EVICT_HEADROOM)
+        for _, path in entries[:len(entries) - keep]:
+            self._remove(path)
+        self.entry_count = keep
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def open_result_cache(cache_dir, index, landmark_index=None, max_entries=DEFAULT_MAX_ENTRIES):
+    """
+    Result cache bound to the given indexes, stale entries from a previous build are dropped on open.
+    """
+    cache = ResultCache(cache_dir, index_version(index, landmark_index), max_entries)
+    cache.evict()
+    return cache
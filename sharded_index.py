@@ -0,0 +1,286 @@
+import argparse
+import json
+import multiprocessing
+import os
+import struct
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import numpy as np
+import find_similar_video
+import reference_index
+
+# a shard manifest is JSON listing every reference video (in the original index order) and where each
+# shard is served from:
+#   {"videos": [{"name": ..., ...}, ...], "hash_count": N,
+#    "shards": [{"path": "shard-0.idx"}, {"address": "10.0.0.7:7001"}, {"address": "/run/vm/shard-2.sock"}]}
+# "path" shards are served by a local worker process started by the coordinator, "address" shards by a
+# `python sharded_index.py serve` worker on that TCP host:port or Unix socket path
+MANIFEST_EXTENSION = '.shards'
+AUTHKEY_ENV = 'VIDEO_MATCHER_SHARD_AUTHKEY'
+
+# every message is one send_bytes frame, never a pickle:
+#   uint32 header length, UTF-8 JSON header, raw payload (little endian uint64 query hashes for a search)
+_FRAME_HEADER = struct.Struct('<I')
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+def shard_authkey():
+    """
+    Shared secret for remote shards, there is deliberately no default: a worker reachable over
+    the network must never accept unauthenticated coordinators.
+    """
+    key = os.environ.get(AUTHKEY_ENV)
+    if not key:
+        raise RuntimeError(f"Remote index shards need a shared secret, set {AUTHKEY_ENV} on the workers and the coordinator.")
+    return key.encode('utf-8')
+
+def send_message(connection, header, payload=b''):
+    header = json.dumps(header).encode('utf-8')
+    connection.send_bytes(_FRAME_HEADER.pack(len(header)) + header + payload)
+
+def recv_message(connection):
+    """
+    (header dict, payload bytes) of the next frame, ValueError when it is malformed.
+    """
+    data = connection.recv_bytes(MAX_MESSAGE_BYTES)
+    if len(data) < _FRAME_HEADER.size:
+        raise ValueError("truncated message")
+    header_length, = _FRAME_HEADER.unpack_from(data)
+    end = _FRAME_HEADER.size + header_length
+    if end > len(data):
+        raise ValueError("truncated message header")
+    header = json.loads(data[_FRAME_HEADER.size:end].decode('utf-8'))
+    if not isinstance(header, dict):
+        raise ValueError("message header is not an object")
+    return header, data[end:]
+
+def parse_address(address):
+    """
+    'host:port' for TCP, anything else is a Unix socket path.
+    """
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return (host, int(port))
+    return address
+
+def split_index(index_path, shard_count, output_dir):
+    """
+    Split a reference index into shard_count binary shard indexes plus a manifest, balancing hash counts.
+    Every shard entry keeps the video's position in the original index so merged rankings break ties
+    exactly like a single-process search.
+    """
+    index = reference_index.load_index(index_path)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # largest videos first onto the lightest shard
+    shards = [[] for _ in range(shard_count)]
+    loads = [0] * shard_count
+    sizes = np.diff(index.offsets)
+    for position in np.argsort(-sizes, kind='stable'):
+        shard = loads.index(min(loads))
+        shards[shard].append(int(position))
+        loads[shard] += int(sizes[position])
+
+    manifest_shards = []
+    for shard, positions in enumerate(shards):
+        positions.sort()
+        entries = [(dict(index.videos[p], position=p), index.hashes[index.offsets[p]:index.offsets[p + 1]]) for p in positions]
+        shard_name = f"shard-{shard}.idx"
+        reference_index.write_index(os.path.join(output_dir, shard_name), entries)
+        manifest_shards.append({'path': shard_name})
+
+    manifest_path = os.path.join(output_dir, f"index{MANIFEST_EXTENSION}")
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump({'videos': index.videos, 'hash_count': int(len(index.hashes)), 'shards': manifest_shards}, manifest_file, indent=1)
+    return manifest_path
+
+def shard_scores(index, query_hashes, top_k=None):
+    """
+    [(position, name, similarity)] of a shard's videos for the query hashes, best first.
+    """
+    if len(index.hashes) == 0:
+        return []  # more shards than videos
+    similarities = find_similar_video.video_similarities(query_hashes, index.names, index.offsets, index.hashes)
+    positions = {video['name']: video.get('position', i) for i, video in enumerate(index.videos)}
+    ranked = sorted(((positions[name], name, float(score)) for name, score in similarities.items()),
+                    key=lambda x: (-x[2], x[0]))
+    return ranked[:top_k] if top_k else ranked
+
+def serve_connection(connection, index):
+    """
+    Answer requests on one connection until it is closed:
+    {"op": "search", "top_k": k} + hashes -> {"status": "ok", "ranked": [[position, name, similarity], ...]}
+    or {"status": "error", "error": message}; {"op": "close"} ends the session.
+    """
+    while True:
+        try:
+            header, payload = recv_message(connection)
+        except (EOFError, OSError):
+            return
+        except ValueError as e:
+            send_message(connection, {'status': 'error', 'error': f"ValueError: {e}"})
+            continue
+        if header.get('op') == 'close':
+            return
+        try:
+            if header.get('op') != 'search':
+                raise ValueError(f"unknown request {header.get('op')!r}")
+            if len(payload) % 8:
+                raise ValueError("query hashes are not a whole number of uint64 values")
+            top_k = header.get('top_k')
+            if top_k is not None and not isinstance(top_k, int):
+                raise ValueError("top_k must be an integer")
+            query_hashes = np.frombuffer(payload, dtype='<u8').astype(np.uint64)
+            send_message(connection, {'status': 'ok', 'ranked': shard_scores(index, query_hashes, top_k)})
+        except Exception as e:
+            send_message(connection, {'status': 'error', 'error': f"{type(e).__name__}: {e}"})
+
+def _local_shard_worker(shard_path, connection):
+    index = reference_index.load_index(shard_path)
+    serve_connection(connection, index)
+    connection.close()
+
+def serve_shard(shard_path, address, authkey=None):
+    """
+    Serve one shard to remote coordinators, each connection in its own thread.
+    Coordinators must present the shared secret from VIDEO_MATCHER_SHARD_AUTHKEY.
+    """
+    authkey = authkey or shard_authkey()
+    index = reference_index.load_index(shard_path)
+    address = parse_address(address)
+    with Listener(address, authkey=authkey) as listener:
+        print(f"Serving {len(index)} reference videos from {shard_path} on {listener.address}.")
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, OSError) as e:
+                print(f"Rejected a connection: {e}")
+                continue
+            threading.Thread(target=serve_connection, args=(connection, index), daemon=True).start()
+
+class ShardedIndex:
+    """
+    Scatter-gather search over index shards served by local worker processes or remote workers.
+    Query hashes are sent to every shard before any reply is read, so shards score in parallel,
+    and the per-shard top-k lists are merged into the global top-k.
+    """
+    def __init__(self, videos, hash_count, connections, processes=(), path=None):
+        self.videos = videos
+        self.names = [video['name'] for video in videos]
+        self.hash_count = hash_count
+        self.connections = connections
+        self.processes = list(processes)
+        self.path = path
+        self.broken = None  # why the index was closed after a transport failure
+        # one request in flight per connection, concurrent callers take turns
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def rank(self, query_hashes, top_k=None):
+        """
+        [(video name, similarity)] across every shard, most similar first, same order as an unsharded search.
+        """
+        query_hashes = np.asarray(query_hashes, dtype=np.uint64)
+        if len(query_hashes) == 0:
+            raise ValueError("No frames could be hashed from the query video.")
+        payload = query_hashes.astype('<u8').tobytes()
+        with self.lock:
+            if self.broken:
+                raise RuntimeError(f"Sharded index is closed: {self.broken}")
+            # a shard that fails mid-exchange may leave replies unread, which would answer the next
+            # query with this one's ranking, so any transport failure closes the whole index
+            try:
+                for shard, connection in enumerate(self.connections):
+                    send_message(connection, {'op': 'search', 'top_k': top_k}, payload)
+                replies = []
+                for shard, connection in enumerate(self.connections):
+                    replies.append((shard, recv_message(connection)[0]))
+            except (EOFError, OSError, ValueError) as e:
+                self.broken = f"index shard {shard} failed: {e or 'worker closed the connection'}"
+                self._close_connections()
+                raise RuntimeError(f"Sharded index is closed: {self.broken}")
+
+        merged = []
+        for shard, reply in replies:
+            if reply.get('status') != 'ok':
+                raise RuntimeError(f"Index shard {shard} failed: {reply.get('error')}")
+            merged.extend(reply['ranked'])
+        if not merged:
+            raise ValueError("The reference index does not contain any frame hashes.")
+        merged.sort(key=lambda x: (-x[2], x[0]))
+        return [(name, score) for _, name, score in (merged[:top_k] if top_k else merged)]
+
+    def _close_connections(self):
+        for connection in self.connections:
+            try:
+                send_message(connection, {'op': 'close'})
+            except OSError:
+                pass
+            connection.close()
+        self.connections = []
+
+    def close(self):
+        with self.lock:
+            self.broken = self.broken or "closed"
+            self._close_connections()
+        for process in self.processes:
+            process.join(timeout=5)
+        self.processes = []
+
+def open_sharded_index(manifest_path, authkey=None):
+    """
+    Connect to every shard of a manifest, starting a worker process for each local shard.
+    Remote shards are refused unless the shared secret is set in VIDEO_MATCHER_SHARD_AUTHKEY.
+    """
+    with open(manifest_path, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    # spawn rather than fork, the coordinator may be a threaded GUI or server process
+    context = multiprocessing.get_context('spawn')
+    if any('address' in shard for shard in manifest['shards']):
+        authkey = authkey or shard_authkey()
+    connections = []
+    processes = []
+    try:
+        for shard in manifest['shards']:
+            if 'address' in shard:
+                connections.append(Client(parse_address(shard['address']), authkey=authkey))
+            else:
+                parent, child = context.Pipe()
+                process = context.Process(target=_local_shard_worker, args=(os.path.join(base_dir, shard['path']), child),
+                                          daemon=True)
+                process.start()
+                child.close()
+                connections.append(parent)
+                processes.append(process)
+    except Exception:
+        ShardedIndex([], 0, connections, processes).close()
+        raise
+    return ShardedIndex(manifest['videos'], manifest['hash_count'], connections, processes, path=manifest_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Split the reference index into shards, or serve one shard to remote coordinators.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    split = commands.add_parser('split', help="write shard indexes and their manifest")
+    split.add_argument('--index', default=None, help="reference index (default: preprocessing.idx, else preprocessing.json)")
+    split.add_argument('--shards', type=int, default=os.cpu_count() or 2, help="number of shards (default: CPU count)")
+    split.add_argument('--output-dir', default='./shards', help="directory for the shards and index.shards (default: ./shards)")
+    serve = commands.add_parser('serve', help="serve one shard index over a socket")
+    serve.add_argument('shard', help="shard index file written by split")
+    serve.add_argument('--address', required=True, help=f"host:port to listen on, or a Unix socket path ({AUTHKEY_ENV} must be set)")
+    args = parser.parse_args()
+
+    if args.command == 'split':
+        manifest_path = split_index(args.index or reference_index.default_index_path(), args.shards, args.output_dir)
+        print(f"Wrote {args.shards} shards and {manifest_path}.")
+    else:
+        try:
+            serve_shard(args.shard, args.address)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
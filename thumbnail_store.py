@@ -0,0 +1,114 @@
+import json
+import os
+import cv2
+import numpy as np
+
+DEFAULT_THUMBNAIL_DIR = './thumbnails'
+
+# width of the stored grayscale frames, height follows the aspect ratio; frame alignment needs every
+# frame, so a 16:9 video costs 128 x 72 bytes a frame, about 1 GB per hour at 30 fps
+THUMBNAIL_WIDTH = 128
+
+# per reference video:
+#   <name>.u8    uint8[frame count, height, width] grayscale frames, raw so they can be written as decoded
+#   <name>.json  {"frames", "height", "width", "fps"}, written last, loaders treat it as the commit marker
+
+def thumbnail_paths(video_name, store_dir=DEFAULT_THUMBNAIL_DIR):
+    """
+    (frames path, metadata path) of a reference video, named after its index entry.
+    """
+    base = os.path.join(store_dir, video_name.replace('/', '__'))
+    return f"{base}.u8", f"{base}.json"
+
+def thumbnail_size(width, height, thumbnail_width=THUMBNAIL_WIDTH):
+    thumbnail_width = min(thumbnail_width, width)
+    return (thumbnail_width, max(1, int(round(height * thumbnail_width / width))))
+
+def to_thumbnail(gray_frame, size):
+    """
+    Downscale a grayscale frame to the store size, area averaging keeps it free of aliasing.
+    """
+    if (gray_frame.shape[1], gray_frame.shape[0]) == size:
+        return gray_frame
+    return cv2.resize(gray_frame, size, interpolation=cv2.INTER_AREA)
+
+class ReferenceThumbnails:
+    """
+    Memory-mapped grayscale thumbnails of every frame of one reference video.
+    """
+    def __init__(self, frames, fps):
+        self.frames = frames
+        self.fps = fps
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def size(self):
+        return (self.frames.shape[2], self.frames.shape[1])
+
+    def frame_range(self, start_time=0, end_time=None):
+        """
+        Frames of the [start_time, end_time) window in seconds, as a view into the mapping.
+        """
+        start = int(round(start_time * self.fps))
+        end = int(round(end_time * self.fps)) if end_time is not None else None
+        return self.frames[start:end]
+
+def build_thumbnails(video_name, video_path, store_dir=DEFAULT_THUMBNAIL_DIR, thumbnail_width=THUMBNAIL_WIDTH, on_frame=None):
+    """
+    Decode every frame of a reference video once and store it as a grayscale thumbnail.
+    on_frame(frame_index, bgr_frame) is called for every decoded frame, so the caller can
+    fingerprint the video in the same pass.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    frames_path, meta_path = thumbnail_paths(video_name, store_dir)
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open {video_path} to build its thumbnails.")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    size = thumbnail_size(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), thumbnail_width)
+
+    # stream frames to disk as they are decoded, a long video never has to fit in memory
+    frame_count = 0
+    tmp_path = f"{frames_path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, 'wb') as frames_file:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if on_frame is not None:
+                    on_frame(frame_count, frame)
+                thumbnail = to_thumbnail(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), size)
+                frames_file.write(np.ascontiguousarray(thumbnail).tobytes())
+                frame_count += 1
+    finally:
+        cap.release()
+    # drop the old commit marker first so no reader maps the new frames with the old shape
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    os.replace(tmp_path, frames_path)
+
+    tmp_path = f"{meta_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as meta_file:
+        json.dump({'frames': frame_count, 'height': size[1], 'width': size[0], 'fps': fps}, meta_file)
+    os.replace(tmp_path, meta_path)
+    return frames_path
+
+def has_thumbnails(video_name, store_dir=DEFAULT_THUMBNAIL_DIR):
+    return all(os.path.exists(path) for path in thumbnail_paths(video_name, store_dir))
+
+def load_thumbnails(video_name, store_dir=DEFAULT_THUMBNAIL_DIR):
+    """
+    Memory-map a reference video's thumbnails, or return None if they were never built.
+    """
+    frames_path, meta_path = thumbnail_paths(video_name, store_dir)
+    if not os.path.exists(meta_path) or not os.path.exists(frames_path):
+        return None
+    with open(meta_path, 'r') as meta_file:
+        meta = json.load(meta_file)
+    if meta['frames'] == 0:
+        return ReferenceThumbnails(np.empty((0, meta['height'], meta['width']), dtype=np.uint8), meta['fps'])
+    frames = np.memmap(frames_path, dtype=np.uint8, mode='r', shape=(meta['frames'], meta['height'], meta['width']))
+    return ReferenceThumbnails(frames, meta['fps'])